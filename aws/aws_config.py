@@ -1,5 +1,8 @@
 import os
 import logging
+import threading
+from collections import defaultdict
+from botocore.config import Config
 
 from aws_cred import AWSCredHelper
 from bedrock_client import BedrockClient
@@ -8,14 +11,147 @@ from ssm_client import SsmClient
 from ses_client import SesClient
 from sql_client import SqlClient
 from user import UserManager
+from session_token import SignedSessionManager
+from history_store import S3HistoryStore, LocalHistoryStore
+from chat_search import ChatSearch
+from readiness import ReadinessProbe
+from single_flight import SingleFlight
+from resilience import enforce_deadline, remaining
+from profiler import SamplingProfiler
+from usage import UsageTracker
 
 logger = logging.getLogger(__name__)
 
+# Per-service transport settings, tuned for an interactive chat
+# Bedrock gets a long read timeout for generation but fewer retries since each attempt is expensive
+SERVICE_SETTINGS = {
+    "bedrock-runtime": {"connect_timeout": 3, "read_timeout": 30, "max_attempts": 2},
+    "s3": {"connect_timeout": 2, "read_timeout": 5, "max_attempts": 3},
+    "ses": {"connect_timeout": 2, "read_timeout": 5, "max_attempts": 3},
+    "ssm": {"connect_timeout": 2, "read_timeout": 5, "max_attempts": 3},
+}
+DEFAULT_SETTINGS = {"connect_timeout": 2, "read_timeout": 10, "max_attempts": 3}
+# Shorter read timeouts a service also gets clients for, so calls late in a request
+# wait at most about as long as the request has left
+TIMEOUT_BUCKETS = (1, 2, 5, 10, 20)
+
+# Counters for AWS client retries, errors and connection pool exhaustion
+class ClientMetrics(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.countLock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.retries = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.poolFull = 0
+        # urllib3 logs a warning when a connection is returned to a full pool
+        poolLogger = logging.getLogger("urllib3.connectionpool")
+        poolLogger.addHandler(self)
+
+    # Count pool exhaustion warnings from urllib3
+    def emit(self, record):
+        if isinstance(record.msg, str) and record.msg.startswith("Connection pool is full"):
+            with self.countLock:
+                self.poolFull += 1
+
+    # Count a completed call, the retries it needed and whether it returned an error
+    def on_after_call(self, http_response, parsed, model, **kwargs):
+        service = model.service_model.service_name
+        retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        with self.countLock:
+            self.calls[service] += 1
+            self.retries[service] += retries
+            if "Error" in parsed:
+                self.errors[service] += 1
+
+    # Count a call that failed without a response (e.g. timeout) after all retries
+    # This event carries no operation model, the service comes from the event name
+    def on_after_call_error(self, exception, event_name, **kwargs):
+        service = event_name.split(".")[1]
+        with self.countLock:
+            self.calls[service] += 1
+            self.errors[service] += 1
+
+    # Snapshot the counters as a dict
+    def snapshot(self):
+        with self.countLock:
+            return {
+                "calls": dict(self.calls),
+                "retries": dict(self.retries),
+                "errors": dict(self.errors),
+                "pool_full": self.poolFull,
+            }
+
+# A boto3 client whose read timeout follows the current request's deadline
+# botocore fixes the read timeout per client, so one client is kept per timeout bucket and
+# each call goes to the one with the longest timeout that fits in what is left of the request
+# All clients are created up front, at startup or after fork, never from a request thread
+class DeadlineClient:
+    def __init__(self, factory, service):
+        self.service = service
+        self.readTimeout = SERVICE_SETTINGS.get(service, DEFAULT_SETTINGS)["read_timeout"]
+        # Read timeout -> client, one per bucket shorter than the service's read timeout
+        self.clients = {readTimeout: factory.create(service, readTimeout)
+                        for readTimeout in [b for b in TIMEOUT_BUCKETS if b < self.readTimeout] + [self.readTimeout]}
+        # The full timeout client also answers attribute lookups like .exceptions
+        self.default = self.clients[self.readTimeout]
+
+    # Read timeout for a call made now
+    def read_timeout(self):
+        left = remaining()
+        if left is None or left >= self.readTimeout:
+            return self.readTimeout
+        return max((b for b in TIMEOUT_BUCKETS if b <= left), default=TIMEOUT_BUCKETS[0])
+
+    # Operations are looked up when called, so the deadline picks the client
+    def __getattr__(self, name):
+        return getattr(self.clients[self.read_timeout()], name)
+
+# Creates boto3 clients with shared, per-service transport settings
+# Passed to the client wrappers in place of the session, which only call .client(service)
+class ClientFactory:
+    def __init__(self, session, concurrency, metrics):
+        self.session = session
+        self.concurrency = concurrency
+        # Leave a few spare connections beyond the number of request threads
+        self.maxPoolConnections = max(10, concurrency + 4)
+        self.metrics = metrics
+        # boto3 sessions are not thread safe, clients are created one at a time
+        self.lock = threading.Lock()
+
+    # Build the botocore Config for a service, readTimeout overrides the service's read timeout
+    def config_for(self, service, readTimeout=None):
+        settings = SERVICE_SETTINGS.get(service, DEFAULT_SETTINGS)
+        return Config(
+            max_pool_connections=self.maxPoolConnections,
+            connect_timeout=settings["connect_timeout"],
+            read_timeout=readTimeout or settings["read_timeout"],
+            retries={"mode": "adaptive", "total_max_attempts": settings["max_attempts"]},
+            tcp_keepalive=True,
+        )
+
+    # Client for a service whose read timeout is capped by the request deadline
+    def client(self, service):
+        return DeadlineClient(self, service)
+
+    # Create a boto3 client for a service and hook it up to the metrics
+    def create(self, service, readTimeout=None):
+        logger.debug("Creating %s client with pool size %s and read timeout %s", service, self.maxPoolConnections, readTimeout)
+        with self.lock:
+            client = self.session.client(service, config=self.config_for(service, readTimeout))
+        client.meta.events.register("after-call.*", self.metrics.on_after_call)
+        client.meta.events.register("after-call-error.*", self.metrics.on_after_call_error)
+        # Stop retrying once the current request is out of time
+        client.meta.events.register("before-send.*", enforce_deadline)
+        return client
+
 class AWSConfig:
     def __init__(self):
         self.configStore = {}
         self.session = None
+        self.clientFactory = None
         self.secretClient = None
+        self.metrics = ClientMetrics()
 
     def reset(self):
         self.configStore = {}
@@ -28,29 +164,76 @@ class AWSConfig:
         awsProfile = os.environ.get("AWSPROFILE", None)
         awsRegion = os.environ.get("AWSREGION")
         self.session = AWSCredHelper().get_session(awsProfile, awsRegion)
+        # Size AWS connection pools to the number of request threads
+        self.clientFactory = ClientFactory(self.session, int(os.environ.get("THREADS", 8)), self.metrics)
         # Set up secrets manager/parameter store client
         logger.debug("Setting up secrets manager/parameter store client")
-        self.secretClient = SsmClient(self.session)
+        self.secretClient = SsmClient(self.clientFactory)
         # Set up SES client
         logger.debug("Setting up SES client")
         self.configStore["sender"] = self.secretClient.get("/genai/sender")
-        self.configStore["emailClient"] = SesClient(self.session, self.configStore["sender"])
+        self.configStore["emailClient"] = SesClient(self.clientFactory, self.configStore["sender"])
         # Get SQL host, username, password, and database name
-        logger.debug(f"Getting database info from AWS")
+        logger.debug("Getting database info from AWS")
         dbHost = os.environ.get("DBHOST") or self.secretClient.get("/genai/dbHost")
         dbName = "genai"
         dbUsername = self.secretClient.get("/genai/dbUsername")
         dbPassword = self.secretClient.get("/genai/dbPassword")
         # Set up SQL client
-        logger.debug(f"Setting up SQL client")
+        logger.debug("Setting up SQL client")
         sqlClient = SqlClient(dbHost, dbName, dbUsername, dbPassword)
         self.configStore["userMan"] = UserManager(sqlClient)
+        # Set up token usage accounting and quotas
+        self.configStore["usage"] = UsageTracker.from_env(sqlClient)
+        # Set up signed sessions if enabled, otherwise sessions stay in the sessions table
+        if os.environ.get("SESSIONMODE", "table") == "signed":
+            logger.debug("Setting up signed session manager")
+            sessionSecret = self.secretClient.get("/genai/sessionSecret")
+            self.configStore["sessionMan"] = SignedSessionManager(sessionSecret, self.configStore["userMan"])
         # Get S3 bucket
-        logger.debug(f"Setting up s3 client")
+        logger.debug("Setting up s3 client")
         bucket = self.secretClient.get("/genai/bucket")
         # Set up S3 client
-        self.configStore["storageClient"] = S3Client(self.session, bucket)
+        self.configStore["storageClient"] = S3Client(self.clientFactory, bucket)
+        # Set up chat history store
+        historyBackend = os.environ.get("HISTORYSTORE", "s3")
+        logger.debug("Setting up %s history store", historyBackend)
+        if historyBackend == "local":
+            self.configStore["historyStore"] = LocalHistoryStore(os.environ.get("HISTORYDIR", "history"))
+        elif historyBackend == "s3":
+            self.configStore["historyStore"] = S3HistoryStore(self.configStore["storageClient"])
+        else:
+            raise ValueError(f"Unknown HISTORYSTORE: {historyBackend}")
+        # Set up chat history search
+        self.configStore["chatSearch"] = ChatSearch(self.configStore["historyStore"])
         # Set up bedrock client
-        logger.debug(f"Setting up bedrock client")
-        self.configStore["genaiClient"] = BedrockClient(self.session, self.configStore["storageClient"])
-        return self.configStore
\ No newline at end of file
+        logger.debug("Setting up bedrock client")
+        self.configStore["genaiClient"] = BedrockClient(
+            self.clientFactory,
+            self.configStore["historyStore"],
+            self.configStore["chatSearch"],
+            self.configStore["usage"]
+        )
+        # Serialize and deduplicate chat submissions per user
+        self.configStore["sendFlight"] = SingleFlight()
+        # Set up the request profiler (off unless PROFILING=1)
+        self.configStore["profiler"] = SamplingProfiler.from_env()
+        # Set up background readiness probes
+        probes = {"mysql": sqlClient.ping, "s3": self.configStore["storageClient"].bucket_check}
+        if os.environ.get("READYBEDROCK", "0") == "1":
+            probes["bedrock"] = self.configStore["genaiClient"].model_check
+        self.configStore["readiness"] = ReadinessProbe(probes, int(os.environ.get("READYINTERVAL", 15)))
+        return self.configStore
+
+    # Recreate the AWS session and clients in a forked worker
+    # boto3 sessions and their connection pools must not be shared across processes
+    # MySQL needs nothing here since SqlClient opens a connection per query
+    def after_fork(self):
+        logger.debug("Recreating AWS session and clients after fork")
+        awsProfile = os.environ.get("AWSPROFILE", None)
+        awsRegion = os.environ.get("AWSREGION")
+        self.session = AWSCredHelper().get_session(awsProfile, awsRegion)
+        self.clientFactory = ClientFactory(self.session, self.clientFactory.concurrency, self.metrics)
+        self.secretClient.reconnect(self.clientFactory)
+        for name in ("emailClient", "storageClient", "genaiClient"):
+            self.configStore[name].reconnect(self.clientFactory)
\ No newline at end of file
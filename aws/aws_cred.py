@@ -12,14 +12,14 @@ class AWSCredHelper:
         try:
             if awsProfile:
                 # If a profile name is provided, use it to create boto3 session
-                logger.debug(f"Using AWS profile: {awsProfile} in region: {awsRegion}")
+                logger.debug("Using AWS profile: %s in region: %s", awsProfile, awsRegion)
                 self.session = boto3.Session(profile_name=awsProfile, region_name=awsRegion)
             else:
                 # Otherwise, use default credentials
-                logger.debug(f"Using default credentials in region: {awsRegion}")
+                logger.debug("Using default credentials in region: %s", awsRegion)
                 self.session = boto3.Session(region_name=awsRegion)
             return self.session
         except Exception as e:
             # Log and raise error
-            logger.error(f"Error creating AWS session: {e}", exc_info=True)
+            logger.error("Error creating AWS session: %s", e, exc_info=True)
             raise
\ No newline at end of file
@@ -1,13 +1,20 @@
 import logging
 from datetime import datetime, timezone
+from request_stats import track
+from history_store import HistoryConflict
+from resilience import breaker, check_deadline
 
 logger = logging.getLogger(__name__)
 
 # Bedrock AI client wrapper
 class BedrockClient:
-    def __init__(self, session, s3Client):
-        # Set up S3 client
-        self.s3 = s3Client
+    def __init__(self, session, historyStore, chatSearch=None, usage=None):
+        # Set up chat history store
+        self.history = historyStore
+        # Search index kept up to date as turns are added (optional)
+        self.search = chatSearch
+        # Token accounting and daily quotas (optional)
+        self.usage = usage
         # Model settings
         self.model = "amazon.nova-micro-v1:0"
         self.system_instructions = """
@@ -23,55 +30,129 @@ class BedrockClient:
         self.top_p = 0.8
         self.max_output_tokens = 400
         # Set up Bedrock AI client
+        self.session = session
         self.client = session.client("bedrock-runtime")
+        # Control plane client, only created for health checks
+        self.controlClient = None
+        # Attempts at saving new turns when another writer changed the history
+        self.writeAttempts = 5
+        # Shared circuit breaker for Bedrock
+        self.breaker = breaker("bedrock")
+        # Seconds a request must have left to start a generation
+        self.minimumBudget = 3
+
+    # Recreate the Bedrock client from a new session (e.g. in a forked worker)
+    def reconnect(self, session):
+        self.session = session
+        self.client = session.client("bedrock-runtime")
+        self.controlClient = None
+
+    # Check that the model is available without running an inference
+    def model_check(self):
+        if self.controlClient is None:
+            self.controlClient = self.session.client("bedrock")
+        self.controlClient.get_foundation_model(modelIdentifier=self.model)
+    # Call the model with the configured instructions and parameters through the circuit breaker,
+    # if the request has time left for a generation
+    def generate(self, messages):
+        check_deadline("bedrock", self.minimumBudget)
+        with track("bedrock"):
+            return self.breaker.call(
+                self.client.converse,
+                modelId=self.model,
+                messages=messages,
+                system=[{'text': self.system_instructions}],
+                inferenceConfig={"maxTokens": self.max_output_tokens, "temperature": self.temperature, "topP": self.top_p}
+            )
+
+    # Generate a response for a user and count its tokens
+    # Only role and content of each turn are sent, Bedrock rejects the other keys stored with them
+    def _converse(self, username, messages):
+        response = self.generate([{"role": turn["role"], "content": turn["content"]} for turn in messages])
+        # Count the tokens against the user
+        if self.usage:
+            self.usage.record(username, response.get("usage", {}))
+        return response
+
+    # Stored answer to the request with this id, or None if the history does not have it
+    def _answered(self, history, requestId):
+        if not requestId:
+            return None
+        for offset in range(len(history) - 1, -1, -1):
+            if history[offset].get("requestId") == requestId:
+                following = history[offset + 1:offset + 2]
+                return following[0]["content"][0]["text"] if following else ""
+        return None
+
     # Define function to send messages to chatbot
-    def send_message(self, username, msg):
-        logger.info(f"send_message: received message from '{username}'")
+    # requestId is saved with the turns, so a duplicate handled by another process is stored once
+    def send_message(self, username, msg, requestId=None):
+        logger.info("send_message: received message from '%s'", username)
+        # Refuse before doing any work if the user is out of tokens for today
+        if self.usage:
+            self.usage.check(username)
         # Handle test messages (do not store in history)
         isTest = False
         if msg.startswith("test:"):
-            logger.info(f"Test message detected for '{username}' - not adding to history")
+            logger.info("Test message detected for '%s' - not adding to history", username)
             msg = msg[len("test:"):].strip()
             isTest = True
-        # Initialize chat history
-        history = []
-        # Keys for storing history in S3
+        # Key for storing history
         key = f"chat-history/{username}.json"
-        # Load existing history if they exist in S3
-        if self.s3.obj_check(key):
-            history, _ = self.s3.obj_read(key)
-            logger.debug(f"Loaded history for user '{username}'")
+        # Load existing history and its version if it exists
+        history, version = self.history.read_versioned(key)
+        if history is None:
+            history = []
+        else:
+            logger.debug("Loaded history for user '%s'", username)
         if isTest:
             timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
             prompt = history.copy()
             prompt.append({"role":"user", "content":[{"text":f"[Query-{timestamp}] {msg}"}]})
-            response = self.client.converse(
-                modelId=self.model,
-                messages=prompt,
-                system=[{'text': self.system_instructions}],
-                inferenceConfig={"maxTokens": self.max_output_tokens, "temperature": self.temperature, "topP": self.top_p}
-            )
+            response = self._converse(username, prompt)
             responseText = response["output"]["message"]["content"][0]["text"]
-            logger.debug(f"Generated response for test message: {responseText}")
+            logger.debug("Generated response for test message: %s", responseText)
             return responseText
+        # A duplicate of a request that was already answered gets the stored answer
+        answer = self._answered(history, requestId)
+        if answer is not None:
+            logger.info("Request %s for '%s' already answered", requestId, username)
+            return answer
         # Current timestamp in UTC
         timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
-        # Add user message to history
-        history.append({"role":"user", "content":[{"text":f"[Query-{timestamp}] {msg}"}]})
-        logger.debug(f"Appended user message to history for '{username}'")
+        # User message, sent with the full chat history
+        userTurn = {"role":"user", "content":[{"text":f"[Query-{timestamp}] {msg}"}]}
+        if requestId:
+            userTurn["requestId"] = requestId
         # Generate model response using the full chat history
-        response = self.client.converse(
-            modelId=self.model,
-            messages=history,
-            system=[{'text': self.system_instructions}],
-            inferenceConfig={"maxTokens": self.max_output_tokens, "temperature": self.temperature, "topP": self.top_p}
-        )
+        response = self._converse(username, history + [userTurn])
         responseText = response["output"]["message"]["content"][0]["text"]
-        logger.info(f"Generated model response for '{username}'")
-        # Add model response to history
-        history.append({"role":"assistant", "content":[{"text":responseText}]})
-        logger.debug(f"Appended model message to history for '{username}'")         
-        # Write updated history back to S3
-        self.s3.obj_write(f"chat-history/{username}.json", history)
-        logger.debug(f"Updated history written to S3 for '{username}'")
+        logger.info("Generated model response for '%s'", username)
+        # Add both turns to history
+        newTurns = [userTurn, {"role":"assistant", "content":[{"text":responseText}]}]
+        # Write updated history back only if nobody else wrote it since it was read,
+        # otherwise append the turns to the newer history (the model is not called again)
+        for attempt in range(self.writeAttempts):
+            try:
+                self.history.write(key, history + newTurns, ifVersion=version)
+                break
+            except HistoryConflict:
+                logger.warning("History for '%s' changed while responding, retrying write (attempt %s)", username, attempt + 1)
+                history, version = self.history.read_versioned(key)
+                history = history or []
+                # A duplicate in another process saved this request first, keep its turns
+                answer = self._answered(history, requestId)
+                if answer is not None:
+                    logger.info("Request %s for '%s' was saved by another writer", requestId, username)
+                    return answer
+        else:
+            raise HistoryConflict(key)
+        history = history + newTurns
+        logger.debug("Updated history written for '%s'", username)
+        # Index the new turns, a failure here should not lose the response
+        if self.search:
+            try:
+                self.search.update(username, history)
+            except Exception as e:
+                logger.error("Failed to update search index for '%s': %s", username, e, exc_info=True)
         return responseText
\ No newline at end of file
@@ -1,5 +1,7 @@
 import logging
 import json
+from request_stats import track
+from resilience import breaker, CircuitOpenError, DeadlineExceeded
 logger = logging.getLogger(__name__)
 
 # S3 client wrapper for CRUD operations
@@ -8,43 +10,78 @@ class S3Client:
         # Save the bucket name and S3 Client
         self.bucket = bucket
         self.s3 = session.client("s3")
-        logger.debug(f"S3Client initialized for bucket: {bucket}")
+        # Shared circuit breaker for S3
+        self.breaker = breaker("s3")
+        logger.debug("S3Client initialized for bucket: %s", bucket)
+
+    # Recreate the S3 client from a new session (e.g. in a forked worker)
+    def reconnect(self, session):
+        self.s3 = session.client("s3")
 
     # Helper function to call S3
     def _s3_call(self, func, *args, **kwargs):
         try:
             # Try to execute the call
-            return func(*args, **kwargs)
+            with track("s3"):
+                return self.breaker.call(func, *args, **kwargs)
         except self.s3.exceptions.ClientError as e:
-            # Log missing object error
+            # Log missing object error (HEAD reports 404, GET reports NoSuchKey)
             code = e.response["Error"]["Code"]
-            if code == "404":
-                logger.debug(f"Object not found: {kwargs.get('Key')}")
+            if code in ("404", "NoSuchKey"):
+                logger.debug("Object not found: %s", kwargs.get('Key'))
                 return None
+            # Log and raise failed conditional write, which callers expect and retry
+            if code in ("PreconditionFailed", "ConditionalRequestConflict"):
+                logger.warning("S3 conditional request failed (%s): %s", code, kwargs.get('Key'))
+                raise
             # Log and raise other S3 client error
-            logger.error(f"S3 ClientError: {e}", exc_info=True)
+            logger.error("S3 ClientError: %s", e, exc_info=True)
+            raise
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            # Log and raise fast failure, no traceback needed
+            logger.warning("S3 call skipped: %s", e)
             raise
         except Exception as e:
             # Log and raise other error
-            logger.error(f"S3 operation failed: {e}", exc_info=True)
+            logger.error("S3 operation failed: %s", e, exc_info=True)
             raise
 
     # Read object from S3
     def obj_read(self, key):
-        logger.debug(f"Attempting to read S3 object: {key}")
+        logger.debug("Attempting to read S3 object: %s", key)
         # Execute S3 call
         response = self._s3_call(self.s3.get_object, Bucket=self.bucket, Key=key)
         # Get data from object
         data = json.loads(response["Body"].read())
         # Get metadata for object
         meta = response.get("Metadata", {})
-        logger.debug(f"Successfully read S3 object: {key}")
+        logger.debug("Successfully read S3 object: %s", key)
         # Return the decoded object
         return data, meta
 
+    # Read object and its ETag from S3, or (None, None) if it does not exist
+    def obj_get(self, key):
+        logger.debug("Attempting to get S3 object: %s", key)
+        # Execute S3 call
+        response = self._s3_call(self.s3.get_object, Bucket=self.bucket, Key=key)
+        if response is None:
+            return None, None
+        # Get data and ETag from object
+        data = json.loads(response["Body"].read())
+        logger.debug("Successfully got S3 object: %s", key)
+        return data, response["ETag"]
+
+    # Get the ETag of an object in S3, or None if it does not exist
+    def obj_etag(self, key):
+        logger.debug("Attempting to get ETag of S3 object: %s", key)
+        # Execute S3 call
+        response = self._s3_call(self.s3.head_object, Bucket=self.bucket, Key=key)
+        return response["ETag"] if response else None
+
     # Write object to S3
-    def obj_write(self, key, obj, contentType="application/json", metadata=None):
-        logger.debug(f"Attempting to write S3 object: {key}")
+    # ifMatch only replaces the object with that ETag, ifNoneMatch="*" only creates a new object
+    def obj_write(self, key, obj, contentType="application/json", metadata=None, ifMatch=None, ifNoneMatch=None):
+        logger.debug("Attempting to write S3 object: %s", key)
         # Format response for S3
         body = json.dumps(obj, indent=2).encode("utf-8")
         # Set up S3 object
@@ -57,33 +94,46 @@ class S3Client:
         # Add metadata if included
         if metadata:
             params["Metadata"] = metadata
+        # Add write conditions if included
+        if ifMatch:
+            params["IfMatch"] = ifMatch
+        if ifNoneMatch:
+            params["IfNoneMatch"] = ifNoneMatch
         # Execute S3 call
-        self._s3_call(self.s3.put_object, **params)
-        logger.debug(f"Successfully wrote S3 object: {key}")
+        response = self._s3_call(self.s3.put_object, **params)
+        logger.debug("Successfully wrote S3 object: %s", key)
+        # Return the new ETag
+        return response["ETag"]
     
     # Delete object from S3
     def obj_delete(self, key):
-        logger.debug(f"Attempting to delete S3 object: {key}")
+        logger.debug("Attempting to delete S3 object: %s", key)
         # Execute S3 call
         self._s3_call(self.s3.delete_object, Bucket=self.bucket, Key=key)
-        logger.debug(f"Successfully deleted S3 object: {key}")
+        logger.debug("Successfully deleted S3 object: %s", key)
     
     # Check that object with key exists in S3
     def obj_check(self, key):
-        logger.debug(f"Attempting to find S3 object: {key}")
+        logger.debug("Attempting to find S3 object: %s", key)
         # Execute S3 call
         exists = bool(self._s3_call(self.s3.head_object, Bucket=self.bucket, Key=key))
-        logger.debug(f"{'Successfully found' if exists else 'Failed to find'} S3 object: {key}")
+        logger.debug("%s S3 object: %s", 'Successfully found' if exists else 'Failed to find', key)
         # Return status
         return exists
     
+    # Check that the bucket exists and is reachable, raise if it does not
+    def bucket_check(self):
+        # _s3_call turns a 404 into None, which here means the bucket is gone
+        if self._s3_call(self.s3.head_bucket, Bucket=self.bucket) is None:
+            raise KeyError(f"S3 bucket not found: {self.bucket}")
+
     # List objects under prefix in S3
     def obj_list(self, prefix):
-        logger.debug(f"Listing objects in bucket {self.bucket} under prefix: {prefix}")
+        logger.debug("Listing objects in bucket %s under prefix: %s", self.bucket, prefix)
         paginator = self.s3.get_paginator("list_objects_v2")
         # Execute S3 call
         pageIterator = self._s3_call(paginator.paginate, Bucket=self.bucket, Prefix=prefix)
         # List S3 keys under prefix
         keys = [obj["Key"] for page in pageIterator for obj in page.get("Contents", []) if obj["Key"] != prefix]
-        logger.debug(f"Found {len(keys)} objects under prefix: {prefix}")
+        logger.debug("Found %s objects under prefix: %s", len(keys), prefix)
         return keys
\ No newline at end of file
@@ -1,4 +1,6 @@
 import logging
+from request_stats import track
+from resilience import breaker
 logger = logging.getLogger(__name__)
 
 # SES client wrapper
@@ -7,12 +9,18 @@ class SesClient:
         # Create SES client
         self.sender = sender
         self.ses = session.client("ses")
-        logger.debug(f"SesClient initialized")
+        # Shared circuit breaker for SES
+        self.breaker = breaker("ses")
+        logger.debug("SesClient initialized")
+
+    # Recreate the SES client from a new session (e.g. in a forked worker)
+    def reconnect(self, session):
+        self.ses = session.client("ses")
 
     # Define function to send email
     def send_email(self, recipients, subject, body):
         try:
-            logger.debug(f"Sending notification to: {recipients}")
+            logger.debug("Sending notification to: %s", recipients)
             # Build request payload
             payload = {
                 "Source": self.sender,
@@ -25,15 +33,16 @@ class SesClient:
                 },
             }
             # Send email
-            res = self.ses.send_email(**payload)
+            with track("ses"):
+                res = self.breaker.call(self.ses.send_email, **payload)
             # Verify that the email is successfully sent
             messageId = res.get("MessageId")
             if messageId:
-                logger.info(f"Notification sent successfully: {messageId}")
+                logger.info("Notification sent successfully: %s", messageId)
             else:
                 # Log if email might not have sent
-                logger.warning(f"Notification may not have been sent: {res}")
+                logger.warning("Notification may not have been sent: %s", res)
         except Exception as e:
             # Log and raise other error
-            logger.error(f"Error sending email to {recipients}: {e}")
+            logger.error("Error sending email to %s: %s", recipients, e)
             raise
\ No newline at end of file
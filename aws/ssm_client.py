@@ -8,25 +8,29 @@ class SsmClient:
         self.ssm = session.client("ssm")
         # Create cache
         self.cache = {}
-        logger.debug(f"AWSSecretClient initialized")
+        logger.debug("AWSSecretClient initialized")
+
+    # Recreate the parameter store client from a new session (e.g. in a forked worker)
+    def reconnect(self, session):
+        self.ssm = session.client("ssm")
     
     # Get secret value
     def get(self, name):
         # Check if secret is in cache
         if name not in self.cache:
-            logger.debug(f"Secret not in cache: {name}")
+            logger.debug("Secret not in cache: %s", name)
             val = None
             try:
                 # Look up secret in parameter store
                 val = self.ssm.get_parameter(Name=name, WithDecryption=True)["Parameter"]["Value"]
-                logger.debug(f"Found secret in Parameter Store: {name}")
+                logger.debug("Found secret in Parameter Store: %s", name)
             except self.ssm.exceptions.ParameterNotFound:
                 # Log and raise not found error if in parameter store
-                logger.warning(f"SSM parameter not found: {name}")
+                logger.warning("SSM parameter not found: %s", name)
                 raise KeyError(f"SSM parameter not found: {name}")
             except Exception as e:
                 # Raise for other errors
-                logger.error(f"Unexpected error fetching secret {name}: {e}", exc_info=True)
+                logger.error("Unexpected error fetching secret %s: %s", name, e, exc_info=True)
                 raise
             self.cache[name] = val
         # Return secret
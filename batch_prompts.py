@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+#
+# Run a file of prompts through the webapp's Bedrock configuration (model, system
+# instructions and inference parameters), without touching any user's history.
+#
+#   python batch_prompts.py prompts.jsonl results.jsonl --concurrency 8 --rate 4
+#
+# Each input line is {"id": "...", "prompt": "..."}, the id defaults to the line number.
+# Each output line holds the id with its response (or error), latency and token usage.
+# Prompts already answered in the output file are skipped, so an interrupted run
+# resumes by running the same command again.
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.exceptions import ClientError
+from resilience import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# Bedrock errors that mean "slow down" rather than "this prompt failed"
+THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException", "ModelNotReadyException"}
+
+# Whether an error means Bedrock is asking us to slow down
+def is_throttle(e):
+    if isinstance(e, CircuitOpenError):
+        return True
+    return isinstance(e, ClientError) and e.response["Error"]["Code"] in THROTTLE_CODES
+
+# Spaces out call starts across worker threads
+# The rate is halved when Bedrock throttles and recovers gradually as calls succeed
+class Pacer:
+    def __init__(self, rate, minRate=0.1):
+        self.maxRate = rate
+        self.rate = rate
+        self.minRate = minRate
+        self.nextAt = time.monotonic()
+        self.throttles = 0
+        self.lock = threading.Lock()
+
+    # Wait for the next start slot
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            startAt = max(now, self.nextAt)
+            self.nextAt = startAt + 1 / self.rate
+        time.sleep(startAt - now)
+
+    # Speed back up after a successful call
+    def success(self):
+        with self.lock:
+            self.rate = min(self.maxRate, self.rate + self.maxRate * 0.05)
+
+    # Slow down and hold every worker back for pause seconds
+    def throttled(self, pause):
+        with self.lock:
+            self.throttles += 1
+            self.rate = max(self.minRate, self.rate / 2)
+            self.nextAt = max(self.nextAt, time.monotonic() + pause)
+            rate = self.rate
+        logger.warning("Throttled, pausing %.1fs and slowing to %.2f prompts/s", pause, rate)
+
+# Appends results to the output file one line at a time, safe to call from any thread
+class ResultWriter:
+    def __init__(self, path):
+        # A run killed mid-write leaves a partial last line, start on a fresh one
+        partial = False
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                partial = f.read(1) != b"\n"
+        self.file = open(path, "a", encoding="utf-8")
+        if partial:
+            self.file.write("\n")
+        self.lock = threading.Lock()
+
+    def write(self, result):
+        line = json.dumps(result, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# Read (id, prompt) pairs from a JSON Lines file
+def load_prompts(path):
+    prompts = []
+    with open(path, encoding="utf-8") as f:
+        for lineNumber, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            prompts.append((str(entry.get("id", lineNumber)), entry["prompt"]))
+    return prompts
+
+# Ids that already have a response in the output file
+def load_done(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Partial line from an interrupted run
+                continue
+            if "error" not in entry:
+                done.add(entry["id"])
+    return done
+
+# Run one prompt, retrying throttled attempts, and return its result line
+def run_prompt(genaiClient, pacer, promptId, prompt, retries):
+    messages = [{"role": "user", "content": [{"text": prompt}]}]
+    for attempt in range(1, retries + 2):
+        pacer.wait()
+        start = time.perf_counter()
+        try:
+            response = genaiClient.generate(messages)
+        except Exception as e:
+            if is_throttle(e) and attempt <= retries:
+                pacer.throttled(getattr(e, "retryAfter", min(2 ** attempt, 30)))
+                continue
+            logger.error("Prompt %s failed: %s", promptId, e)
+            return {"id": promptId, "error": f"{type(e).__name__}: {e}", "attempts": attempt}
+        latency = time.perf_counter() - start
+        pacer.success()
+        try:
+            usage = response.get("usage", {})
+            return {
+                "id": promptId,
+                "response": response["output"]["message"]["content"][0]["text"],
+                "latency_ms": round(latency * 1000, 2),
+                "input_tokens": usage.get("inputTokens", 0),
+                "output_tokens": usage.get("outputTokens", 0),
+                "attempts": attempt,
+            }
+        except (KeyError, IndexError, TypeError, AttributeError) as e:
+            # e.g. a response with no text content, which retrying would not fix
+            logger.error("Prompt %s returned an unexpected response: %s", promptId, e)
+            return {"id": promptId, "error": f"Unexpected response: {type(e).__name__}: {e}", "attempts": attempt}
+
+# Nearest-rank percentile of sorted values
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Run prompts from a JSON Lines file through the webapp's Bedrock configuration")
+    parser.add_argument("input", help="JSON Lines file of {\"id\", \"prompt\"} objects")
+    parser.add_argument("output", help="JSON Lines file results are appended to (also used to resume)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Prompts in flight at once")
+    parser.add_argument("--rate", type=float, default=2.0, help="Maximum prompts started per second")
+    parser.add_argument("--retries", type=int, default=5, help="Retries per prompt when throttled")
+    parser.add_argument("--verbose", action="store_true", help="Enable debug logging")
+    args = parser.parse_args()
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)-11s [%(levelname)s] %(message)s (%(name)s:%(lineno)d)"
+    )
+    prompts = load_prompts(args.input)
+    done = load_done(args.output)
+    pending = [(promptId, prompt) for promptId, prompt in prompts if promptId not in done]
+    logger.info("%s prompts, %s already answered, %s to run", len(prompts), len(prompts) - len(pending), len(pending))
+    if not pending:
+        return 0
+    # Reuse the webapp's configuration, with a connection pool sized for the workers
+    os.environ["THREADS"] = str(args.concurrency)
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "aws")))
+    from aws_config import AWSConfig
+    genaiClient = AWSConfig().create()["genaiClient"]
+    pacer = Pacer(args.rate)
+    writer = ResultWriter(args.output)
+    results = []
+
+    # Run a prompt and write its result as soon as it is done
+    # Any failure becomes an error line for that prompt, the rest of the run carries on
+    def work(promptId, prompt):
+        try:
+            result = run_prompt(genaiClient, pacer, promptId, prompt, args.retries)
+        except Exception as e:
+            logger.error("Prompt %s failed: %s", promptId, e, exc_info=True)
+            result = {"id": promptId, "error": f"{type(e).__name__}: {e}"}
+        writer.write(result)
+        results.append(result)
+
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    interrupted = False
+    try:
+        futures = [executor.submit(work, promptId, prompt) for promptId, prompt in pending]
+        for count, future in enumerate(as_completed(futures), 1):
+            future.result()
+            if count % 50 == 0:
+                logger.info("Completed %s/%s prompts", count, len(pending))
+    except KeyboardInterrupt:
+        interrupted = True
+        logger.warning("Interrupted, finishing prompts in flight (run again to resume)")
+    finally:
+        # In-flight prompts still write their results
+        executor.shutdown(wait=True, cancel_futures=True)
+        writer.close()
+    elapsed = time.perf_counter() - start
+    succeeded = [r for r in results if "error" not in r]
+    failed = len(results) - len(succeeded)
+    outputTokens = sum(r["output_tokens"] for r in succeeded)
+    print(f"prompts={len(results)} ok={len(succeeded)} failed={failed} skipped={len(prompts) - len(pending)} "
+          f"throttled={pacer.throttles} elapsed={elapsed:.1f}s")
+    print(f"throughput={len(results) / elapsed:.2f} prompts/s {outputTokens / elapsed:.1f} output tokens/s "
+          f"tokens in={sum(r['input_tokens'] for r in succeeded)} out={outputTokens}")
+    if succeeded:
+        ordered = sorted(r["latency_ms"] for r in succeeded)
+        print(f"latency p50={percentile(ordered, 0.5):.0f}ms p90={percentile(ordered, 0.9):.0f}ms p99={percentile(ordered, 0.99):.0f}ms")
+    return 130 if interrupted else (1 if failed else 0)
+
+if __name__ == "__main__":
+    sys.exit(main())
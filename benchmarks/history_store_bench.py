@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+#
+# Compare per-message history latency between the local and S3 history stores.
+# Each simulated message does what BedrockClient.send_message does with the
+# store: read the history, append a user turn and a model turn, write it back.
+#
+#   python benchmarks/history_store_bench.py --messages 200
+#   python benchmarks/history_store_bench.py --messages 50 --s3   # also needs AWS access
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "aws"))
+from history_store import LocalHistoryStore, S3HistoryStore
+
+# Run the simulated conversation and return per-message latencies in ms
+def run(store, key, messages, turnSize):
+    text = "x" * turnSize
+    latencies = []
+    store.delete(key)
+    try:
+        for i in range(messages):
+            start = time.perf_counter()
+            history = store.read(key) or []
+            history.append({"role": "user", "content": [{"text": f"[Query-{i}] {text}"}]})
+            history.append({"role": "assistant", "content": [{"text": text}]})
+            store.write(key, history)
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        store.delete(key)
+    return latencies
+
+# Print summary statistics for one store
+def report(name, latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(f"{name:<12} mean={statistics.mean(ordered):8.2f}ms  p50={statistics.median(ordered):8.2f}ms  "
+          f"p95={p95:8.2f}ms  last={latencies[-1]:8.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark history store backends")
+    parser.add_argument("--messages", type=int, default=200, help="Messages per conversation")
+    parser.add_argument("--turn-size", type=int, default=500, help="Characters per turn")
+    parser.add_argument("--s3", action="store_true", help="Also benchmark the S3 store from AWSConfig")
+    args = parser.parse_args()
+    key = "bench/chat-history/history-store-bench.json"
+    with tempfile.TemporaryDirectory() as tmpDir:
+        local = LocalHistoryStore(tmpDir)
+        report("local", run(local, key, args.messages, args.turn_size))
+    if args.s3:
+        from aws_config import AWSConfig
+        s3 = S3HistoryStore(AWSConfig().create()["storageClient"])
+        report("s3", run(s3, key, args.messages, args.turn_size))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+#
+# Measure the logging overhead a request thread pays per request with the old
+# synchronous basicConfig setup and with the queue-based setup in log_config.
+# Each simulated request emits the mix of records a /send request produces:
+# a few INFO records and several DEBUG records that are filtered out at INFO.
+#
+#   python benchmarks/logging_bench.py --requests 20000
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+import log_config
+
+logger = logging.getLogger("bench")
+
+# Emit one request's worth of records
+def fake_request(username, history):
+    logger.info("send_message: received message from '%s'", username)
+    logger.debug("Attempting to find S3 object: %s", f"chat-history/{username}.json")
+    logger.debug("Loaded history for user '%s'", username)
+    logger.debug("Appended user message to history for '%s'", username)
+    logger.info("Generated model response for '%s'", username)
+    logger.debug("Model response for %s: %s", username, history)
+    logger.debug("Updated history written for '%s'", username)
+
+# Return mean microseconds per request spent in the calling thread
+def run(requests):
+    history = [{"role": "user", "content": [{"text": "x" * 200}]}] * 20
+    start = time.perf_counter()
+    for i in range(requests):
+        fake_request(f"user{i % 50}", history)
+    return (time.perf_counter() - start) / requests * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-request logging overhead")
+    parser.add_argument("--requests", type=int, default=20000, help="Simulated requests per mode")
+    args = parser.parse_args()
+    root = logging.getLogger()
+    # Unbuffered like stderr, so each record costs a write system call
+    with tempfile.TemporaryFile("w", buffering=1) as syncOut, tempfile.TemporaryFile("w", buffering=1) as queueOut:
+        # Old setup: format and write in the calling thread
+        logging.basicConfig(stream=syncOut, level=logging.INFO,
+                            format="%(asctime)-11s [%(levelname)s] %(message)s (%(name)s:%(lineno)d)")
+        syncUs = run(args.requests)
+        # New setup: enqueue in the calling thread, format and write on the listener thread
+        root.handlers = []
+        os.environ.setdefault("LOGLEVEL", "INFO")
+        log_config.setup_logging(stream=queueOut)
+        queueUs = run(args.requests)
+        drainStart = time.perf_counter()
+        log_config.stop_logging()
+        drainMs = (time.perf_counter() - drainStart) * 1000
+    print(f"basicConfig (sync)   {syncUs:8.2f} us/request")
+    print(f"QueueHandler (async) {queueUs:8.2f} us/request  (listener drained backlog in {drainMs:.1f} ms)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+#
+# Closed-loop HTTP load generator for comparing single-process waitress with
+# the multi-process launcher. Start the server one way, run the benchmark,
+# then repeat with the other:
+#
+#   waitress-serve --port=8080 --threads=8 genai_webapp:app
+#   python serve.py --port 8080 --workers 4 --threads 8
+#
+#   python benchmarks/serve_bench.py --url http://127.0.0.1:8080/login \
+#       --method POST --data "username=bench&password=wrong" --concurrency 32 --duration 20
+#
+# POST /login runs bcrypt and renders a template, which is the GIL-bound work
+# the launcher is meant to spread across cores.
+
+import time
+import argparse
+import threading
+import http.client
+import statistics
+from urllib.parse import urlsplit
+
+# Issue requests on one keep-alive connection until the deadline
+def client_loop(url, method, body, headers, deadline, latencies, errors):
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    conn = None
+    while time.perf_counter() < deadline:
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+            start = time.perf_counter()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            if response.status >= 500:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(repr(e))
+            conn = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure HTTP throughput and latency")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/ping", help="URL to request")
+    parser.add_argument("--method", default="GET", help="HTTP method")
+    parser.add_argument("--data", default=None, help="Form-encoded request body")
+    parser.add_argument("--cookie", default=None, help="Cookie header, e.g. sessionToken=...")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent connections")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run")
+    args = parser.parse_args()
+    headers = {}
+    body = None
+    if args.data is not None:
+        body = args.data.encode()
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+    if args.cookie:
+        headers["Cookie"] = args.cookie
+    latencies, errors = [], []
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=client_loop, args=(args.url, args.method, body, headers, deadline, latencies, errors))
+               for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if not latencies:
+        print(f"No successful requests ({len(errors)} errors)")
+        return
+    ordered = sorted(latencies)
+    pct = lambda p: ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+    print(f"requests={len(latencies)} errors={len(errors)} throughput={len(latencies) / elapsed:.1f} req/s")
+    print(f"latency mean={statistics.mean(ordered) * 1000:.1f}ms p50={pct(0.5):.1f}ms p95={pct(0.95):.1f}ms p99={pct(0.99):.1f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import re
+import math
+import heapq
+import logging
+import secrets
+import threading
+from collections import Counter, OrderedDict
+from history_store import turn_text
+
+logger = logging.getLogger(__name__)
+
+# Bump when the index layout changes so old indexes are rebuilt
+INDEX_VERSION = 1
+# Characters of each turn kept for snippets
+PREVIEW_LENGTH = 400
+# Characters shown around the first match
+SNIPPET_LENGTH = 160
+# Previews per chunk, full chunks are moved out of the index into their own object
+PREVIEW_CHUNK = 100
+
+TOKEN_RE = re.compile(r"\w+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "i", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "with", "you",
+}
+
+# Split text into lowercase index terms
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+# Per-user inverted index over chat history turns
+# The index object holds the postings and the previews of the newest turns, older previews
+# sit in immutable chunks, so saving the index after a message does not rewrite every preview
+class ChatSearch:
+    def __init__(self, historyStore, cacheSize=256, chunkCacheSize=512):
+        # Store that holds histories and their indexes
+        self.store = historyStore
+        # Recently used indexes by username as (index, version)
+        self.cache = OrderedDict()
+        self.cacheSize = cacheSize
+        # Recently used preview chunks by key, chunks never change once written
+        self.chunks = OrderedDict()
+        self.chunkCacheSize = chunkCacheSize
+        self.cacheLock = threading.Lock()
+        logger.debug("ChatSearch initialized")
+
+    # Keys for a user's history, index and preview chunks, each under its own prefix
+    # so no username can make one collide with another
+    def history_key(self, username):
+        return f"chat-history/{username}.json"
+
+    def index_key(self, username):
+        return f"chat-index/{username}.json"
+
+    def chunk_key(self, username, index, number):
+        return f"chat-preview/{username}/{index['generation']}-{number}.json"
+
+    # Create an empty index
+    def _empty(self):
+        # postings: term -> flat [offset, count, offset, count, ...]
+        # chunks: number of full preview chunks written, tail: previews after them as [role, timestamp, text]
+        # generation: names the chunks, a rebuilt index never reads chunks of the one it replaced
+        return {"version": INDEX_VERSION, "generation": secrets.token_hex(4), "turns": 0,
+                "postings": {}, "chunks": 0, "tail": [], "lastTimestamp": None}
+
+    # Get a user's index and its version from the cache
+    # revalidate checks the stored version first and only downloads the index if it changed
+    def _load(self, username, revalidate=False):
+        with self.cacheLock:
+            cached = self.cache.get(username)
+            if cached:
+                self.cache.move_to_end(username)
+        if cached and not (revalidate and self.store.version(self.index_key(username)) != cached[1]):
+            return cached
+        index, version = self.store.read_versioned(self.index_key(username))
+        if not index or index.get("version") != INDEX_VERSION:
+            index = self._empty()
+        self._remember(username, index, version)
+        return index, version
+
+    # Put an index in the cache, evicting the least recently used
+    def _remember(self, username, index, version):
+        with self.cacheLock:
+            self.cache[username] = (index, version)
+            self.cache.move_to_end(username)
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+
+    # Drop a user's cached index, after a failed save it no longer matches the stored one
+    def _forget(self, username):
+        with self.cacheLock:
+            self.cache.pop(username, None)
+
+    # Get a preview chunk through the chunk cache
+    def _chunk(self, key):
+        with self.cacheLock:
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                self.chunks.move_to_end(key)
+                return chunk
+        chunk = self.store.read(key) or []
+        self._remember_chunk(key, chunk)
+        return chunk
+
+    def _remember_chunk(self, key, chunk):
+        with self.cacheLock:
+            self.chunks[key] = chunk
+            self.chunks.move_to_end(key)
+            while len(self.chunks) > self.chunkCacheSize:
+                self.chunks.popitem(last=False)
+
+    # Preview [role, timestamp, text] of the turn at offset
+    # Reads the tail before the chunk count, update moves a full tail out in the opposite order
+    def _preview(self, username, index, offset):
+        tail = index["tail"]
+        chunks = index["chunks"]
+        number = offset // PREVIEW_CHUNK
+        if number >= chunks:
+            return tail[offset - chunks * PREVIEW_CHUNK]
+        chunk = self._chunk(self.chunk_key(username, index, number))
+        # A missing chunk only costs the snippet
+        return chunk[offset % PREVIEW_CHUNK] if offset % PREVIEW_CHUNK < len(chunk) else [None, None, ""]
+
+    # Add turns history[index["turns"]:] to the index, writing out each preview chunk that fills up
+    def _add_turns(self, username, index, history):
+        for offset in range(index["turns"], len(history)):
+            turn = history[offset]
+            # User turns carry a timestamp, model turns inherit it
+            text, timestamp = turn_text(turn)
+            index["lastTimestamp"] = timestamp or index["lastTimestamp"]
+            for term, count in Counter(tokenize(text)).items():
+                index["postings"].setdefault(term, []).extend((offset, count))
+            index["tail"].append([turn.get("role"), index["lastTimestamp"], " ".join(text.split())[:PREVIEW_LENGTH]])
+            if len(index["tail"]) == PREVIEW_CHUNK:
+                key = self.chunk_key(username, index, index["chunks"])
+                self.store.write(key, index["tail"])
+                self._remember_chunk(key, index["tail"])
+                index["chunks"] += 1
+                index["tail"] = []
+        index["turns"] = len(history)
+
+    # Index any turns of history not yet in the user's index and save it
+    # history is the full, current history, so an index that missed turns catches up here
+    def update(self, username, history):
+        index, version = self._load(username)
+        if index["turns"] > len(history):
+            # History was replaced or truncated, start over
+            index = self._empty()
+        if index["turns"] == len(history):
+            return
+        try:
+            self._add_turns(username, index, history)
+            version = self.store.write(self.index_key(username), index)
+        except Exception:
+            self._forget(username)
+            raise
+        self._remember(username, index, version)
+        logger.debug("Indexed %s turns for user '%s'", index["turns"], username)
+
+    # Build the index for a user whose history predates search
+    def _build(self, username):
+        history = self.store.read(self.history_key(username)) or []
+        index, version = self._empty(), None
+        self._add_turns(username, index, history)
+        if history:
+            version = self.store.write(self.index_key(username), index)
+        self._remember(username, index, version)
+        logger.info("Built search index for user '%s' (%s turns)", username, index["turns"])
+        return index
+
+    # Cut a snippet of text around the first occurrence of any term
+    def _snippet(self, text, terms):
+        lowered = text.lower()
+        positions = [p for p in (lowered.find(term) for term in terms) if p >= 0]
+        start = max(0, min(positions) - SNIPPET_LENGTH // 4) if positions else 0
+        snippet = text[start:start + SNIPPET_LENGTH]
+        return ("..." if start else "") + snippet + ("..." if start + SNIPPET_LENGTH < len(text) else "")
+
+    # Return the best matching turns for a query, newest first among equal scores
+    # Costs a version check, plus a download when the index changed and one per uncached preview chunk
+    def search(self, username, query, limit=10):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        # Revalidate the cached index so turns indexed by other processes are included
+        index, _ = self._load(username, revalidate=True)
+        if index["turns"] == 0:
+            index = self._build(username)
+        # Turns an update is adding while we read are left out
+        turns = index["turns"]
+        totalTurns = max(turns, 1)
+        scores = Counter()
+        for term in terms:
+            postings = index["postings"].get(term)
+            if not postings:
+                continue
+            # Rarer terms weigh more
+            idf = math.log(1 + totalTurns / (len(postings) // 2))
+            for i in range(0, len(postings), 2):
+                if postings[i] < turns:
+                    scores[postings[i]] += (1 + math.log(postings[i + 1])) * idf
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+        results = []
+        for offset, score in best:
+            role, timestamp, text = self._preview(username, index, offset)
+            results.append({
+                "offset": offset,
+                "role": role,
+                "timestamp": timestamp,
+                "score": round(score, 3),
+                "snippet": self._snippet(text, terms),
+            })
+        return results
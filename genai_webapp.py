@@ -2,29 +2,33 @@
 
 import os
 import sys
+import time
+import hashlib
 import logging
 import secrets
 from datetime import datetime, timedelta, timezone
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_from_directory
+from flask import Flask, g, render_template, request, redirect, url_for, jsonify, send_from_directory
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Add parent folder to sys.path so we can import
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "aws")))
 from aws_config import AWSConfig
+from history_store import history_page
+from log_config import setup_logging, REQUEST_ID
+import request_stats
+import resilience
+from resilience import CircuitOpenError, DeadlineExceeded
+from usage import QuotaExceeded
 
 # Configure Logging
-logging.basicConfig(
-    stream=sys.stderr,
-    level=logging.INFO,
-    format="%(asctime)-11s [%(levelname)s] %(message)s (%(name)s:%(lineno)d)"
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 # Initialize AWS config
 aws_config = AWSConfig()
 try:
     config_store = aws_config.create()
 except Exception as e:
-    logger.error(f"Failed to initialize AWS config: {e}", exc_info=True)
+    logger.error("Failed to initialize AWS config: %s", e, exc_info=True)
     sys.exit(1)
 
 # Flask app setup
@@ -36,19 +40,99 @@ app.secret_key = os.urandom(32)
 
 # Check if session is available
 def check_session():
+    # Reuse the result if this request already checked
+    if "username" in g:
+        return g.username
     # Check if the user has a valid session
     sessionToken = request.cookies.get("sessionToken")
-    userMan = app.config["Config"]["userMan"]
-    if sessionToken:
-        return userMan.check_session_token(sessionToken)
-    return None
+    if not sessionToken:
+        g.username = None
+    # Signed sessions are validated locally without a database lookup
+    elif app.config["Config"].get("sessionMan"):
+        g.username = app.config["Config"]["sessionMan"].check(sessionToken)
+    else:
+        g.username = app.config["Config"]["userMan"].check_session_token(sessionToken)
+    return g.username
+
+# Users allowed to use the /admin routes
+ADMIN_USERS = {name.strip() for name in os.environ.get("ADMINUSERS", "").split(",") if name.strip()}
+
+# Return the logged-in username if it is an admin, otherwise None
+def check_admin():
+    username = check_session()
+    return username if username in ADMIN_USERS else None
 
 # Update session expiration
 def update_session(username):
+    sessionMan = app.config["Config"].get("sessionMan")
+    if sessionMan:
+        # Signed sessions are extended by re-issuing the cookie in after_request
+        refreshedToken = sessionMan.refresh(request.cookies.get("sessionToken"))
+        if refreshedToken:
+            g.sessionToken = refreshedToken
+        return
     userMan = app.config["Config"]["userMan"]
     newExpire = datetime.now() + timedelta(minutes=30)
     userMan.update_session(username, newExpire)
 
+# Set session cookie on response
+def set_session_cookie(response, sessionToken):
+    response.set_cookie(
+        "sessionToken",
+        sessionToken,
+        httponly=True,
+        secure=False,
+        samesite="Lax",
+    )
+    return response
+
+# Tag log records from this request with a request id
+@app.before_request
+def assign_request_id():
+    REQUEST_ID.set(request.headers.get("X-Request-ID", "")[:64] or secrets.token_hex(8))
+
+# Count and time dependency calls made by this request
+@app.before_request
+def start_request_stats():
+    request_stats.start_request(request.endpoint)
+
+# Give the request an end-to-end deadline that bounds its dependency calls
+@app.before_request
+def start_request_deadline():
+    resilience.start_deadline(request.endpoint)
+
+# Profile sampled requests, or one an admin asked for with "X-Profile: 1"
+@app.before_request
+def start_profile():
+    profiler = app.config["Config"]["profiler"]
+    if not profiler.enabled:
+        return
+    flagged = request.headers.get("X-Profile") == "1" and check_admin() is not None
+    if profiler.should_profile(request.endpoint, flagged):
+        g.profileFlagged = flagged
+        g.profileStart = time.perf_counter()
+        profiler.begin()
+
+# Finish dependency accounting, logged at DEBUG by the request_stats logger
+@app.teardown_request
+def end_request_stats(exc):
+    request_stats.end_request()
+    resilience.end_deadline()
+    if "profileStart" in g:
+        app.config["Config"]["profiler"].end(
+            request.endpoint, REQUEST_ID.get(), time.perf_counter() - g.profileStart, g.profileFlagged
+        )
+
+# Set a re-issued session cookie if one was created during the request
+@app.after_request
+def refresh_session_cookie(response):
+    sessionToken = g.pop("sessionToken", None)
+    if sessionToken:
+        set_session_cookie(response, sessionToken)
+    # Return the request id so clients can quote it
+    response.headers["X-Request-ID"] = REQUEST_ID.get()
+    return response
+
 # Set route for unspecified page
 @app.route("/")
 def index():
@@ -83,26 +167,24 @@ def login():
             errorMessage = "User email has not been confirmed"
         if errorMessage:
             # If there is an error, rerender login.html and display error
-            logger.warning(f"Failed login attempt for user: {username}")
+            logger.warning("Failed login attempt for user: %s", username)
             return render_template("login.html", error=errorMessage)
         # Otherwise, redirect to /chat
         else:
-            # Generate session token
-            sessionToken = secrets.token_urlsafe(32)
-            expire = datetime.now(timezone.utc) + timedelta(minutes=30)
-            # Add session
-            userMan.add_session(username, sessionToken, expire)
+            sessionMan = app.config["Config"].get("sessionMan")
+            if sessionMan:
+                # Generate signed session token
+                sessionToken = sessionMan.issue(username)
+            else:
+                # Generate session token
+                sessionToken = secrets.token_urlsafe(32)
+                expire = datetime.now(timezone.utc) + timedelta(minutes=30)
+                # Add session
+                userMan.add_session(username, sessionToken, expire)
             # Set session cookie
-            response = redirect(url_for("chat"))
-            response.set_cookie(
-                "sessionToken",
-                sessionToken,
-                httponly=True,
-                secure=False,
-                samesite="Lax",
-            )
+            response = set_session_cookie(redirect(url_for("chat")), sessionToken)
             # Redirect to the chat
-            logger.info(f"User {username} logged in with session {sessionToken}")
+            logger.info("User %s logged in with session %s", username, sessionToken)
             return response
     # Handle error query parameters
     error_map = {
@@ -120,9 +202,13 @@ def logout():
     userMan = app.config["Config"]["userMan"]
     # Remove session from sessions table
     username = check_session()
-    if username:
+    sessionMan = app.config["Config"].get("sessionMan")
+    if username and sessionMan:
+        sessionMan.revoke(request.cookies.get("sessionToken"))
+        logger.info("User %s logged out and session revoked.", username)
+    elif username:
         userMan.delete_token(username, userMan.sessionTable)
-        logger.info(f"User {username} logged out and session removed.")
+        logger.info("User %s logged out and session removed.", username)
     else:
         logger.info("Invalid or expired session during logout.")
     # Remove cookie
@@ -159,7 +245,7 @@ def signup():
                 errorMessage = "Email already in use"
         # If there's an error
         if errorMessage:
-            logger.warning(f"Failed signup attempt for user: {newUsername}")
+            logger.warning("Failed signup attempt for user: %s", newUsername)
             # Rerender signup.html and display error
             return render_template("signup.html", error=errorMessage)
         # If no error,
@@ -191,7 +277,7 @@ def signup():
                 Chatbot Helper Security Team
             """
             app.config["Config"]["emailClient"].send_email([newEmail], subject, body)
-            logger.info(f"User {newUsername} signed up.")
+            logger.info("User %s signed up.", newUsername)
             # Render signup_success.html
             return render_template("signup_success.html")
     # Render signup.html
@@ -206,12 +292,12 @@ def confirm_email():
     username = userMan.check_confirm_token(token)
     # If token is invalid
     if not username:
-        logger.warning(f"Failed email confirmation attempt for user: {username}")
+        logger.warning("Failed email confirmation attempt for user: %s", username)
         # Redirect to login page and display error
         return redirect(url_for("login", error="confirm_expired"))
     # Otherwise, confirm the user
     userMan.update_confirm(username, token)
-    logger.info(f"User {username} confirmed email")
+    logger.info("User %s confirmed email", username)
     # Render confirm_email_success.html
     return render_template("confirm_email_success.html")
 
@@ -251,11 +337,11 @@ def forgot_password():
             """
             app.config["Config"]["emailClient"].send_email([email], subject, body)
             # Render forgot_password_success.html
-            logger.info(f"User {matchedUser['username']} requested password reset.")
+            logger.info("User %s requested password reset.", matchedUser['username'])
             return render_template("forgot_password_success.html", email=email)
         else:
             # Rerender forgot_password_success.html and display error
-            logger.warning(f"Failed password reset request for user: {email}")
+            logger.warning("Failed password reset request for user: %s", email)
             return render_template("forgot_password.html", error="Email not found")
     # Render forgot_password.html
     return render_template("forgot_password.html")
@@ -269,7 +355,7 @@ def reset_password():
     username = userMan.check_reset_token(token)
     # If token is invalid
     if not username:
-        logger.warning(f"Failed password reset attempt for user: {username}")
+        logger.warning("Failed password reset attempt for user: %s", username)
         # Redirect to login page and display error
         return redirect(url_for("login", error="reset_expired"))
     # Otherwise, allow password reset
@@ -288,7 +374,11 @@ def reset_password():
             return render_template("reset_password.html", error=errorMessage)
         # If no errors, reset the password
         userMan.update_reset(username, newPassword)
-        logger.info(f"User {username} reset password.")
+        # End any signed sessions that were issued with the old password
+        sessionMan = app.config["Config"].get("sessionMan")
+        if sessionMan:
+            sessionMan.revoke_user(username)
+        logger.info("User %s reset password.", username)
         # Render reset_password_success.html
         return render_template("reset_password_success.html")
     # Render reset_password.html
@@ -322,11 +412,16 @@ def change_password():
             errorMessage = "Passwords do not match"
         if errorMessage:
             # Rerender change_password.html and display error
-            logger.warning(f"Failed password change attempt for user: {username}")
+            logger.warning("Failed password change attempt for user: %s", username)
             return render_template('change_password.html', error=errorMessage)
         # If no errors, change the password
         userMan.change_password(username, newPassword)
-        logger.info(f"User {username} changed password.")
+        # End other signed sessions and re-issue this one
+        sessionMan = app.config["Config"].get("sessionMan")
+        if sessionMan:
+            sessionMan.revoke_user(username)
+            g.sessionToken = sessionMan.issue(username)
+        logger.info("User %s changed password.", username)
         # Redirect to /chat
         return redirect(url_for("chat"))
     # Render change_password.html
@@ -361,7 +456,7 @@ def send_message():
     data = request.get_json()
     # Extract message
     userInput = data.get("message", "").strip()
-    logger.debug(f"User {username} sent message: {userInput}")
+    logger.debug("User %s sent message: %s", username, userInput)
     # Reject empty messages
     if not userInput:
         return jsonify({"error": "Empty message"}), 400
@@ -369,18 +464,91 @@ def send_message():
     maxLength = 2000
     if len(userInput) > maxLength:
         return jsonify({"error": f"Message too long. Limit is {maxLength} characters."}), 400
+    # Client generated id, so a resubmitted message is answered once
+    requestId = str(data.get("requestId") or request.headers.get("Idempotency-Key", ""))[:64] or None
+    if requestId:
+        # Tie the id to the message so a reused id cannot return another message's answer
+        requestId += ":" + hashlib.sha1(userInput.encode("utf-8")).hexdigest()[:12]
     try:
         # If there is a message, try to send the message to chatbot
-        response = app.config["Config"]["genaiClient"].send_message(username, userInput)
-        logger.debug(f"Model response for {username}: {response}")
+        # Messages from one user are answered one at a time, duplicates share the answer
+        response = app.config["Config"]["sendFlight"].do(
+            username, requestId,
+            lambda: app.config["Config"]["genaiClient"].send_message(username, userInput, requestId)
+        )
+        logger.debug("Model response for %s: %s", username, response)
         # Return the response
         return jsonify({"response": response})
+    except QuotaExceeded as e:
+        # The user has used up today's tokens
+        response = jsonify({"error": "You have reached your daily usage limit. Please try again tomorrow."})
+        response.headers["Retry-After"] = str(int(e.retryAfter))
+        return response, 429
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        # A dependency is failing or too slow, answer right away so the client can retry later
+        logger.warning("Message for %s not processed: %s", username, e)
+        return unavailable(e)
     except Exception as e:
         # If there is an error while handling the message,
-        logger.error(f"Error processing message for {username}: {e}", exc_info=True)
+        logger.error("Error processing message for %s: %s", username, e, exc_info=True)
         # Return the error
         return jsonify({"error": str(e)}), 500
 
+# Set backend for /history
+@app.route("/history")
+def history():
+    # Check that user is logged in
+    username = check_session()
+    if username:
+        # Update session expiration
+        update_session(username)
+    else:
+        # If not redirect to login page and display error
+        return redirect(url_for("login", error="session_expired"))
+    # Extract cursor (offset of the oldest message already shown) and page size
+    before = request.args.get("before", None, type=int)
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+    store = app.config["Config"]["historyStore"]
+    key = f"chat-history/{username}.json"
+    # The page only changes when the stored history does, so derive the ETag from its version
+    def page_etag(version):
+        return hashlib.sha1(f"{version}|{before}|{limit}".encode()).hexdigest()[:20]
+    version = store.version(key)
+    etag = page_etag(version)
+    if request.if_none_match.contains_weak(etag):
+        response = app.make_response(("", 304))
+    else:
+        # Read through the cache with the version just checked, a miss costs a single GET
+        historyTurns, version = store.read_cached(key, version=version)
+        messages, nextCursor = history_page(historyTurns or [], before, limit)
+        etag = page_etag(version)
+        response = jsonify({"messages": messages, "next": nextCursor})
+    response.set_etag(etag, weak=True)
+    # Let the browser keep the page but revalidate it on every use
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+# Set backend for /search
+@app.route("/search")
+def search():
+    # Check that user is logged in
+    username = check_session()
+    if username:
+        # Update session expiration
+        update_session(username)
+    else:
+        # If not redirect to login page and display error
+        return redirect(url_for("login", error="session_expired"))
+    # Extract query and number of results
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Empty query"}), 400
+    limit = min(max(request.args.get("limit", 10, type=int), 1), 50)
+    # Search the user's chat history
+    results = app.config["Config"]["chatSearch"].search(username, query, limit)
+    logger.debug("User %s searched history: %s results", username, len(results))
+    return jsonify({"query": query, "results": results})
+
 # Set route /favicon.ico for browsers
 @app.route('/favicon.ico')
 def favicon():
@@ -395,6 +563,54 @@ def favicon():
 def ping():
     return "pong"
 
+# Set route /ready to report cached dependency probe results to load balancers
+@app.route("/ready")
+def ready():
+    isReady, report = app.config["Config"]["readiness"].status()
+    return jsonify(report), 200 if isReady else 503
+
+# Set route /metrics to report AWS client retries, errors and pool exhaustion for this process
+@app.route("/metrics")
+def metrics():
+    breakers = {name: breaker.snapshot() for name, breaker in resilience.BREAKERS.items()}
+    return jsonify({"pid": os.getpid(), "aws": aws_config.metrics.snapshot(), "breakers": breakers})
+
+# Set route /admin/profiles to list the kept request profiles of this process
+@app.route("/admin/profiles")
+def admin_profiles():
+    profiler = app.config["Config"]["profiler"]
+    if not profiler.enabled or not check_admin():
+        return jsonify({"error": "Not found"}), 404
+    return jsonify({"pid": os.getpid(), "rates": profiler.rates, "slow_ms": profiler.slowMs, "profiles": profiler.list()})
+
+# Set route /admin/profiles/<id> to download a profile as collapsed stacks (flamegraph.pl, speedscope)
+@app.route("/admin/profiles/<profileId>")
+def admin_profile(profileId):
+    profiler = app.config["Config"]["profiler"]
+    if not profiler.enabled or not check_admin():
+        return jsonify({"error": "Not found"}), 404
+    collapsed = profiler.collapsed(profileId)
+    if collapsed is None:
+        return jsonify({"error": "Not found"}), 404
+    return collapsed, 200, {
+        "Content-Type": "text/plain; charset=utf-8",
+        "Content-Disposition": f"attachment; filename=profile-{profileId}.folded",
+    }
+
+# Build a 503 response for a failing dependency or an exhausted deadline
+def unavailable(e):
+    response = jsonify({"error": "Service temporarily unavailable, please try again shortly."})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(max(1, int(getattr(e, "retryAfter", 5))))
+    return response
+
+# Fail fast on any route when a dependency circuit is open or the deadline is spent
+@app.errorhandler(CircuitOpenError)
+@app.errorhandler(DeadlineExceeded)
+def handle_unavailable(e):
+    logger.warning("Request failed fast: %s", e)
+    return unavailable(e)
+
 # Create a global error handler
 @app.errorhandler(Exception)
 def handle_exception(e):
@@ -0,0 +1,202 @@
+import os
+import re
+import json
+import fcntl
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Default for write(): replace the object whatever its version
+ANY_VERSION = object()
+
+# Raised when a conditional write finds the object at a different version
+class HistoryConflict(Exception):
+    pass
+
+# Prefix BedrockClient puts on user turns
+QUERY_PREFIX_RE = re.compile(r"^\[Query-([^\]]+)\]\s*")
+
+# Split a stored turn into (text, timestamp), dropping the "[Query-<timestamp>]" prefix of user turns
+def turn_text(turn):
+    text = "".join(part.get("text", "") for part in turn.get("content", []))
+    match = QUERY_PREFIX_RE.match(text)
+    if match:
+        return text[match.end():], match.group(1)
+    return text, None
+
+# Return one page of history, newest first, and the offset to pass as before for the next older page
+def history_page(history, before=None, limit=20):
+    end = len(history) if before is None else max(0, min(before, len(history)))
+    start = max(0, end - limit)
+    messages = []
+    for offset in range(end - 1, start - 1, -1):
+        text, timestamp = turn_text(history[offset])
+        messages.append({"offset": offset, "role": history[offset].get("role"), "text": text, "timestamp": timestamp})
+    return messages, (start if start > 0 else None)
+
+# Interface for storing chat histories and other per-user JSON documents by key
+class HistoryStore:
+    def __init__(self, cacheSize=64):
+        # Recently read objects by key as (obj, version)
+        self.cache = OrderedDict()
+        self.cacheSize = cacheSize
+        self.cacheLock = threading.Lock()
+
+    # Read the object stored under key, or None if it does not exist
+    def read(self, key):
+        return self.read_versioned(key)[0]
+
+    # Read the object and its version, or (None, None) if it does not exist
+    def read_versioned(self, key):
+        raise NotImplementedError
+
+    # Get the current version of the object without reading it, or None if it does not exist
+    def version(self, key):
+        raise NotImplementedError
+
+    # Read through a small cache that is revalidated against the current version
+    # Pass version when the caller already has it to save looking it up again
+    # The returned object is shared, callers must not modify it
+    def read_cached(self, key, version=ANY_VERSION):
+        if version is ANY_VERSION:
+            version = self.version(key)
+        if version is None:
+            return None, None
+        with self.cacheLock:
+            cached = self.cache.get(key)
+            if cached and cached[1] == version:
+                self.cache.move_to_end(key)
+                return cached
+        obj, version = self.read_versioned(key)
+        with self.cacheLock:
+            self.cache[key] = (obj, version)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+        return obj, version
+
+    # Store obj under key and return its new version
+    # ifVersion makes the write conditional: a version means "only if still at this version",
+    # None means "only if it does not exist", otherwise HistoryConflict is raised
+    def write(self, key, obj, ifVersion=ANY_VERSION):
+        raise NotImplementedError
+
+    # Remove the object stored under key
+    def delete(self, key):
+        raise NotImplementedError
+
+# History store backed by an S3 bucket
+class S3HistoryStore(HistoryStore):
+    def __init__(self, s3Client):
+        super().__init__()
+        # S3 client for the history bucket
+        self.s3 = s3Client
+        logger.debug("S3HistoryStore initialized")
+
+    # A single GET that treats a missing object as empty, versioned by the S3 ETag
+    def read_versioned(self, key):
+        return self.s3.obj_get(key)
+
+    def version(self, key):
+        return self.s3.obj_etag(key)
+
+    def write(self, key, obj, ifVersion=ANY_VERSION):
+        conditions = {}
+        if ifVersion is None:
+            conditions["ifNoneMatch"] = "*"
+        elif ifVersion is not ANY_VERSION:
+            conditions["ifMatch"] = ifVersion
+        try:
+            return self.s3.obj_write(key, obj, **conditions)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise HistoryConflict(key) from e
+            raise
+
+    def delete(self, key):
+        self.s3.obj_delete(key)
+
+# History store backed by a local directory
+class LocalHistoryStore(HistoryStore):
+    def __init__(self, root):
+        super().__init__()
+        # Directory that holds the stored objects
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        logger.debug("LocalHistoryStore initialized in: %s", self.root)
+
+    # Map a key onto a path under root
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid history key: {key}")
+        return path
+
+    # Hold the write lock for a key
+    # flock locks belong to the open file, so this also serializes threads of one process
+    # Readers need no lock since writers swap in complete files
+    @contextmanager
+    def _locked(self, key):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.lock", "a") as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                yield path
+            finally:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+    # Version a file by inode, modification time and size, which change on every replace
+    def _version(self, stat):
+        return f'"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def read_versioned(self, key):
+        logger.debug("Attempting to read local object: %s", key)
+        try:
+            with open(self._path(key), "rb") as f:
+                stat = os.fstat(f.fileno())
+                return json.loads(f.read()), self._version(stat)
+        except FileNotFoundError:
+            logger.debug("Object not found: %s", key)
+            return None, None
+
+    def version(self, key):
+        try:
+            return self._version(os.stat(self._path(key)))
+        except FileNotFoundError:
+            return None
+
+    def write(self, key, obj, ifVersion=ANY_VERSION):
+        logger.debug("Attempting to write local object: %s", key)
+        body = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+        with self._locked(key) as path:
+            # Check the write condition while holding the lock
+            if ifVersion is not ANY_VERSION and self.version(key) != ifVersion:
+                logger.warning("Local conditional write failed: %s", key)
+                raise HistoryConflict(key)
+            # Write to a temporary file and swap it in so readers never see a partial file
+            fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(body)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmpPath, path)
+            except Exception:
+                os.unlink(tmpPath)
+                raise
+            version = self.version(key)
+        logger.debug("Successfully wrote local object: %s", key)
+        return version
+
+    def delete(self, key):
+        with self._locked(key) as path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Id of the request being handled by the current thread
+REQUEST_ID = contextvars.ContextVar("request_id", default="-")
+
+# Listener thread that writes queued records for this process
+_listener = None
+
+# Text format used when LOGFORMAT=text
+TEXT_FORMAT = "%(asctime)-11s [%(levelname)s] [%(request_id)s] %(message)s (%(name)s:%(lineno)d)"
+
+# Attach the current request id to every record
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = REQUEST_ID.get()
+        return True
+
+# Format records as one JSON object per line
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "line": record.lineno,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+# Queue handler that hands records to the listener without formatting them first
+# Records stay in this process, so the message and arguments are formatted on the listener thread
+class LocalQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+# Parse "module=LEVEL,other=LEVEL" into a dict
+def parse_levels(spec):
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+# Route all logging through a queue so request threads never block on log I/O
+def setup_logging(stream=sys.stderr):
+    # Handler that does the actual I/O on the listener thread
+    outputHandler = logging.StreamHandler(stream)
+    if os.environ.get("LOGFORMAT", "json") == "text":
+        outputHandler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        outputHandler.setFormatter(JsonFormatter())
+    # Handler used by request threads, which only enqueues records
+    queueHandler = LocalQueueHandler(queue.SimpleQueue())
+    queueHandler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    root.handlers = [queueHandler]
+    root.setLevel(os.environ.get("LOGLEVEL", "INFO").upper())
+    # Per-module levels, e.g. LOGLEVELS="bedrock_client=DEBUG,urllib3=WARNING"
+    for name, level in parse_levels(os.environ.get("LOGLEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+    # Start the listener now and again in forked children, whose copy of the thread is gone
+    def start_listener():
+        global _listener
+        queueHandler.queue = queue.SimpleQueue()
+        _listener = QueueListener(queueHandler.queue, outputHandler, respect_handler_level=True)
+        _listener.start()
+    start_listener()
+    os.register_at_fork(after_in_child=start_listener)
+    atexit.register(stop_logging)
+
+# Write any queued records and stop the listener thread
+def stop_logging():
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
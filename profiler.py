@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import random
+import logging
+import secrets
+import threading
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# Frames kept per sample, deeper stacks are cut at the root end
+MAX_DEPTH = 128
+
+# Parse "route=0.05,other=1" into a dict of sampling rates
+def parse_rates(spec):
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, rate = item.partition("=")
+        rates[route.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+# Collapse a frame and its callers into "file:function;file:function" from the root down
+def collapse(frame):
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+# Statistical profiler for live requests
+# A background thread samples the stacks of the request threads being profiled,
+# so profiled requests run unmodified and others pay nothing
+class SamplingProfiler:
+    def __init__(self, enabled=False, rates=None, interval=0.005, slowMs=500, ringSize=20):
+        self.enabled = enabled
+        # Route -> fraction of its requests to profile
+        self.rates = rates or {}
+        # Seconds between samples
+        self.interval = interval
+        # Sampled requests at least this slow are kept, flagged requests always are
+        self.slowMs = slowMs
+        # Most recent kept profiles, oldest dropped first
+        self.profiles = deque(maxlen=ringSize)
+        # Thread ident -> Counter of collapsed stacks, for requests being profiled
+        self.active = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        # Process that owns the sampler thread (threads do not survive fork)
+        self.pid = None
+        logger.debug("SamplingProfiler initialized (enabled: %s)", enabled)
+
+    # Build a profiler from PROFILING* environment settings
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.environ.get("PROFILING", "0") == "1",
+            parse_rates(os.environ.get("PROFILEROUTES", "")),
+            float(os.environ.get("PROFILEINTERVAL", 5)) / 1000,
+            float(os.environ.get("PROFILESLOWMS", 500)),
+            int(os.environ.get("PROFILERING", 20)),
+        )
+
+    # Whether to profile a request to route, flagged when an explicit profile was asked for
+    def should_profile(self, route, flagged=False):
+        if not self.enabled:
+            return False
+        return flagged or random.random() < self.rates.get(route, 0.0)
+
+    # Start the sampler thread for this process if it is not running
+    def _start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.active = {}
+            threading.Thread(target=self._loop, name="profiler", daemon=True).start()
+
+    # Sample every profiled thread until none are left, then sleep until woken
+    def _loop(self):
+        while True:
+            self.wake.wait()
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, stacks in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[collapse(frame)] += 1
+                if not self.active:
+                    self.wake.clear()
+            del frames
+            time.sleep(self.interval)
+
+    # Begin profiling the calling thread
+    def begin(self):
+        self._start()
+        with self.lock:
+            self.active[threading.get_ident()] = Counter()
+        self.wake.set()
+
+    # Stop profiling the calling thread and keep the profile if it is slow or was asked for
+    def end(self, route, requestId, seconds, keep=False):
+        with self.lock:
+            stacks = self.active.pop(threading.get_ident(), None)
+        if stacks is None or not (keep or seconds * 1000 >= self.slowMs):
+            return None
+        profile = {
+            "id": secrets.token_hex(6),
+            "route": route,
+            "request_id": requestId,
+            "duration_ms": round(seconds * 1000, 2),
+            "samples": sum(stacks.values()),
+            "captured_at": time.time(),
+            "stacks": stacks,
+        }
+        with self.lock:
+            self.profiles.append(profile)
+        logger.info("Kept profile %s of %s (%sms, %s samples)", profile["id"], route, profile["duration_ms"], profile["samples"])
+        return profile
+
+    # Summaries of the kept profiles, newest first
+    def list(self):
+        with self.lock:
+            profiles = list(self.profiles)
+        return [{k: v for k, v in profile.items() if k != "stacks"} for profile in reversed(profiles)]
+
+    # A kept profile in collapsed stack format ("frame;frame count" per line), or None
+    def collapsed(self, profileId):
+        with self.lock:
+            profile = next((p for p in self.profiles if p["id"] == profileId), None)
+        if profile is None:
+            return None
+        return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].most_common())
@@ -0,0 +1,69 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Runs dependency probes on a background thread and serves the cached results
+class ReadinessProbe:
+    def __init__(self, probes, interval=15):
+        # Dict of name -> callable that raises if the dependency is unavailable
+        self.probes = probes
+        # Seconds between probe rounds
+        self.interval = interval
+        # Latest results, replaced as a whole so readers never see a partial round
+        self.results = {}
+        self.checkedAt = None
+        # Process that owns the probe thread (threads do not survive fork)
+        self.pid = None
+        self.startLock = threading.Lock()
+        logger.debug("ReadinessProbe initialized for: %s", ", ".join(probes))
+
+    # Start the probe thread for this process if it is not running
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.startLock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.results = {}
+            self.checkedAt = None
+            threading.Thread(target=self._loop, name="readiness-probe", daemon=True).start()
+
+    # Probe every dependency, forever
+    def _loop(self):
+        while True:
+            self.run_once()
+            time.sleep(self.interval)
+
+    # Probe every dependency once
+    def run_once(self):
+        results = {}
+        for name, probe in self.probes.items():
+            start = time.perf_counter()
+            try:
+                probe()
+                results[name] = {"ok": True}
+            except Exception as e:
+                logger.warning("Readiness probe '%s' failed: %s", name, e)
+                results[name] = {"ok": False, "error": type(e).__name__}
+            results[name]["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        self.results = results
+        self.checkedAt = time.time()
+
+    # Return (ready, report) from the cached results without touching any dependency
+    def status(self):
+        self.start()
+        results, checkedAt = self.results, self.checkedAt
+        if checkedAt is None:
+            return False, {"ready": False, "reason": "pending", "checks": {}}
+        age = time.time() - checkedAt
+        # Results older than a few rounds mean the probe thread is stuck
+        stale = age > 3 * self.interval + 30
+        ready = not stale and all(result["ok"] for result in results.values())
+        report = {"ready": ready, "age_s": round(age, 1), "checks": results}
+        if stale:
+            report["reason"] = "stale"
+        return ready, report
@@ -0,0 +1,108 @@
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Stats for the request being handled by the current thread
+CURRENT = contextvars.ContextVar("request_stats", default=None)
+
+# Callbacks that receive the stats of every finished request
+OBSERVERS = []
+
+# Upper bounds on dependency calls per request, by Flask endpoint
+# Raise a bound only when a new round trip is intended
+ROUTE_BUDGETS = {
+    "index": {"sql": 1},
+    "home": {"sql": 1},
+    "chat": {"sql": 2},
+    "login": {"sql": 3},
+    "logout": {"sql": 2},
+    "signup": {"sql": 4, "ses": 1},
+    "confirm_email": {"sql": 3},
+    "forgot_password": {"sql": 3, "ses": 1},
+    "reset_password": {"sql": 4},
+    "change_password": {"sql": 4},
+    # History GET and PUT, index GET (when not cached) and PUT, a preview chunk PUT every 100 turns
+    "send_message": {"sql": 2, "s3": 5, "bedrock": 1},
+    # Index HEAD and GET, plus a GET per uncached preview chunk among the 10 default results
+    "search": {"sql": 2, "s3": 12},
+    "history": {"sql": 2, "s3": 2},
+    "admin_profiles": {"sql": 1},
+    "admin_profile": {"sql": 1},
+}
+
+# Counts and times the dependency calls made while handling one request
+class RequestStats:
+    def __init__(self, route):
+        self.route = route
+        self.start = time.perf_counter()
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+
+    # Record one call to a dependency
+    def record(self, kind, seconds):
+        self.calls[kind] += 1
+        self.seconds[kind] += seconds
+
+    # Summarize the request as a dict
+    def summary(self):
+        return {
+            "route": self.route,
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 2),
+            "calls": dict(self.calls),
+            "ms": {kind: round(seconds * 1000, 2) for kind, seconds in self.seconds.items()},
+        }
+
+# Count and time a dependency call if a request is being tracked
+@contextmanager
+def track(kind):
+    stats = CURRENT.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.record(kind, time.perf_counter() - start)
+
+# Begin tracking a request
+def start_request(route):
+    stats = RequestStats(route)
+    CURRENT.set(stats)
+    return stats
+
+# Finish tracking the current request and return its stats
+def end_request():
+    stats = CURRENT.get()
+    if stats is None:
+        return None
+    CURRENT.set(None)
+    # Building the summary costs more than the lazy log call saves, so only do it when it is logged
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Request stats: %s", stats.summary())
+    for observer in list(OBSERVERS):
+        observer(stats)
+    return stats
+
+# Test helper: fail if any request made inside the block exceeds its call budget
+# Limits default to ROUTE_BUDGETS for the request's route, keyword limits override them
+@contextmanager
+def assert_max_calls(route=None, **limits):
+    seen = []
+    OBSERVERS.append(seen.append)
+    try:
+        yield seen
+    finally:
+        OBSERVERS.remove(seen.append)
+    for stats in seen:
+        if route and stats.route != route:
+            continue
+        budget = {**ROUTE_BUDGETS.get(stats.route, {}), **limits}
+        for kind, count in stats.calls.items():
+            limit = budget.get(kind, 0)
+            if count > limit:
+                raise AssertionError(f"{stats.route} made {count} {kind} calls (limit {limit}): {stats.summary()}")
@@ -0,0 +1,169 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from botocore.exceptions import BotoCoreError, ClientError, ParamValidationError
+
+logger = logging.getLogger(__name__)
+
+# Monotonic time by which the current request must finish, None outside requests
+DEADLINE = contextvars.ContextVar("deadline", default=None)
+
+# End-to-end budget in seconds per Flask endpoint, DEADLINE env for the rest
+ROUTE_DEADLINES = {
+    "send_message": 45,
+    "signup": 15,
+    "forgot_password": 15,
+}
+
+# Error codes that mean the dependency is unhealthy rather than the request being wrong
+FAILURE_CODES = {
+    "Throttling", "ThrottlingException", "ThrottledException", "TooManyRequestsException",
+    "RequestLimitExceeded", "SlowDown", "ServiceUnavailable", "ServiceUnavailableException",
+    "InternalError", "InternalFailure", "InternalServerException", "ModelNotReadyException",
+}
+
+# Raised when the request has too little time left for another dependency call
+class DeadlineExceeded(Exception):
+    pass
+
+# Raised instead of calling a dependency whose circuit is open
+class CircuitOpenError(Exception):
+    def __init__(self, name, retryAfter):
+        super().__init__(f"{name} is unavailable, retry in {retryAfter:.0f}s")
+        self.name = name
+        self.retryAfter = retryAfter
+
+# Begin the deadline for a request
+def start_deadline(route):
+    seconds = ROUTE_DEADLINES.get(route, float(os.environ.get("DEADLINE", 10)))
+    DEADLINE.set(time.monotonic() + seconds)
+
+# Clear the deadline once the request is done
+def end_deadline():
+    DEADLINE.set(None)
+
+# Seconds left for the current request, None if there is no deadline
+def remaining():
+    deadline = DEADLINE.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+# Fail fast if less than minimum seconds are left for a call to what
+def check_deadline(what, minimum=0.0):
+    left = remaining()
+    if left is not None and left < minimum:
+        raise DeadlineExceeded(f"Request deadline reached before calling {what} ({max(left, 0):.2f}s left)")
+
+# Timeout for one call: the default, shortened to what is left of the deadline
+def call_timeout(what, default, minimum=0.1):
+    check_deadline(what, minimum)
+    left = remaining()
+    return default if left is None else min(default, left)
+
+# botocore before-send handler: refuse attempts (including retries) past the deadline
+def enforce_deadline(request, event_name="AWS", **kwargs):
+    check_deadline(event_name.partition(".")[2])
+
+# Whether an exception means the dependency failed, as opposed to e.g. a missing key
+def is_dependency_failure(e):
+    if isinstance(e, ClientError):
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return status >= 500 or e.response["Error"]["Code"] in FAILURE_CODES
+    if isinstance(e, ParamValidationError):
+        return False
+    return isinstance(e, (BotoCoreError, OSError, TimeoutError))
+
+# Circuit breaker for one dependency
+# closed: calls go through, consecutive failures are counted
+# open: calls fail immediately until resetTimeout has passed
+# half-open: one trial call decides between closed and open
+class CircuitBreaker:
+    def __init__(self, name, failureThreshold=5, resetTimeout=30, isFailure=is_dependency_failure):
+        self.name = name
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.isFailure = isFailure
+        self.state = "closed"
+        self.failures = 0
+        self.openedAt = 0.0
+        self.trialRunning = False
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    # Decide whether a call may go ahead, and whether it is the half-open trial
+    def _admit(self):
+        with self.lock:
+            if self.state == "open":
+                waited = time.monotonic() - self.openedAt
+                if waited < self.resetTimeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.resetTimeout - waited)
+                self.state = "half-open"
+                logger.info("Circuit '%s' half-open, trying one call", self.name)
+            if self.state == "half-open":
+                if self.trialRunning:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 1)
+                self.trialRunning = True
+                return True
+            return False
+
+    # Record the outcome of a call
+    def _record(self, trial, failed):
+        with self.lock:
+            if trial:
+                self.trialRunning = False
+            if not failed:
+                if self.state != "closed":
+                    logger.info("Circuit '%s' closed", self.name)
+                self.state = "closed"
+                self.failures = 0
+                return
+            self.failures += 1
+            if trial or self.failures >= self.failureThreshold:
+                if self.state != "open":
+                    logger.warning("Circuit '%s' opened after %s consecutive failures", self.name, self.failures)
+                self.state = "open"
+                self.openedAt = time.monotonic()
+
+    # Call fn through the breaker
+    def call(self, fn, *args, **kwargs):
+        trial = self._admit()
+        try:
+            result = fn(*args, **kwargs)
+        except DeadlineExceeded:
+            # Out of time on our side, which says nothing about the dependency
+            if trial:
+                self._release()
+            raise
+        except Exception as e:
+            self._record(trial, self.isFailure(e))
+            raise
+        self._record(trial, False)
+        return result
+
+    # Give up a half-open trial without an outcome
+    def _release(self):
+        with self.lock:
+            self.trialRunning = False
+
+    # Current state for /metrics
+    def snapshot(self):
+        with self.lock:
+            return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+
+# Breakers by dependency name, shared by every client in the process
+BREAKERS = {}
+BREAKERS_LOCK = threading.Lock()
+
+# Get the breaker for a dependency, creating it from BREAKER* env settings on first use
+def breaker(name):
+    with BREAKERS_LOCK:
+        if name not in BREAKERS:
+            BREAKERS[name] = CircuitBreaker(
+                name,
+                int(os.environ.get("BREAKERTHRESHOLD", 5)),
+                float(os.environ.get("BREAKERRESET", 30)),
+            )
+        return BREAKERS[name]
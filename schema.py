@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+import logging
+from datetime import datetime, timedelta
+
+from sql_client import SqlClient
+from user import UserManager
+from usage import UsageTracker
+
+logger = logging.getLogger(__name__)
+
+# Table that records which migrations have been applied
+VERSION_TABLE = "schema_version"
+
+# Raised when a migration cannot be applied, the migration is then not recorded
+class MigrationError(Exception):
+    pass
+
+# Keys migration 1 declares, as table -> [(name, kind, columns)]
+# Tables that existed before migrations keep their definition under CREATE TABLE IF NOT EXISTS,
+# so migration 1 also adds whichever of these keys they are missing
+TABLE_KEYS = {
+    "users": [
+        ("PRIMARY", "PRIMARY KEY", ["id"]),
+        ("uq_users_username", "UNIQUE KEY", ["username"]),
+        ("uq_users_email", "UNIQUE KEY", ["email"]),
+    ],
+    **{table: [
+        ("PRIMARY", "PRIMARY KEY", ["token"]),
+        (f"uq_{table}_username", "UNIQUE KEY", ["username"]),
+        (f"idx_{table}_expiration", "KEY", ["expiration"]),
+    ] for table in ("confirmation", "password_reset", "sessions")},
+}
+
+# Ordered list of migrations as (version, description, steps)
+# A step is a SQL statement or a function called with the SchemaManager
+# Never edit a released migration, append a new one instead
+MIGRATIONS = [
+    (1, "Create users, confirmation, password_reset and sessions tables", [
+        """CREATE TABLE IF NOT EXISTS users (
+            id INT UNSIGNED NOT NULL AUTO_INCREMENT,
+            username VARCHAR(64) NOT NULL,
+            password VARCHAR(255) NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            confirmed BOOLEAN NOT NULL DEFAULT FALSE,
+            PRIMARY KEY (id),
+            UNIQUE KEY uq_users_username (username),
+            UNIQUE KEY uq_users_email (email)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+        """CREATE TABLE IF NOT EXISTS confirmation (
+            token VARCHAR(64) NOT NULL,
+            username VARCHAR(64) NOT NULL,
+            expiration DATETIME NOT NULL,
+            PRIMARY KEY (token),
+            UNIQUE KEY uq_confirmation_username (username),
+            KEY idx_confirmation_expiration (expiration),
+            CONSTRAINT fk_confirmation_user FOREIGN KEY (username)
+                REFERENCES users (username) ON DELETE CASCADE ON UPDATE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+        """CREATE TABLE IF NOT EXISTS password_reset (
+            token VARCHAR(64) NOT NULL,
+            username VARCHAR(64) NOT NULL,
+            expiration DATETIME NOT NULL,
+            PRIMARY KEY (token),
+            UNIQUE KEY uq_password_reset_username (username),
+            KEY idx_password_reset_expiration (expiration),
+            CONSTRAINT fk_password_reset_user FOREIGN KEY (username)
+                REFERENCES users (username) ON DELETE CASCADE ON UPDATE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+        """CREATE TABLE IF NOT EXISTS sessions (
+            token VARCHAR(64) NOT NULL,
+            username VARCHAR(64) NOT NULL,
+            expiration DATETIME NOT NULL,
+            PRIMARY KEY (token),
+            UNIQUE KEY uq_sessions_username (username),
+            KEY idx_sessions_expiration (expiration),
+            CONSTRAINT fk_sessions_user FOREIGN KEY (username)
+                REFERENCES users (username) ON DELETE CASCADE ON UPDATE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+        lambda schemaMan: schemaMan.add_missing_keys(TABLE_KEYS),
+    ]),
+    (2, "Create session_revocation table for signed sessions", [
+        """CREATE TABLE IF NOT EXISTS session_revocation (
+            id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+            username VARCHAR(64) NOT NULL,
+            session_id VARCHAR(64) NULL,
+            revoked_at DATETIME(6) NOT NULL,
+            expiration DATETIME NOT NULL,
+            PRIMARY KEY (id),
+            KEY idx_session_revocation_username (username),
+            KEY idx_session_revocation_expiration (expiration)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    ]),
+    (3, "Create token_usage table for per-user Bedrock token accounting", [
+        """CREATE TABLE IF NOT EXISTS token_usage (
+            username VARCHAR(64) NOT NULL,
+            day DATE NOT NULL,
+            input_tokens BIGINT UNSIGNED NOT NULL DEFAULT 0,
+            output_tokens BIGINT UNSIGNED NOT NULL DEFAULT 0,
+            requests INT UNSIGNED NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, day),
+            KEY idx_token_usage_day (day),
+            CONSTRAINT fk_token_usage_user FOREIGN KEY (username)
+                REFERENCES users (username) ON DELETE CASCADE ON UPDATE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+    ]),
+]
+
+# Access types in EXPLAIN output that mean every row (or every index entry) is read
+FULL_SCAN_TYPES = {"ALL", "index"}
+
+# SQL client that records queries instead of executing them
+class RecordingSqlClient(SqlClient):
+    def __init__(self):
+        super().__init__(None, None, None, None)
+        self.queries = []
+
+    # Record the query and return an empty result
+    def _execute(self, sql, params=(), fetch=False, many=False):
+        self.queries.append((sql, params[0] if many else params))
+        return [] if fetch else None
+
+# Drop duplicate statements while keeping their first-seen order
+def unique_queries(queries):
+    unique = {}
+    for sql, params in queries:
+        unique.setdefault(sql, params)
+    return list(unique.items())
+
+# Collect every query UserManager issues by running each method against a recording client
+def collect_user_queries():
+    recorder = RecordingSqlClient()
+    userMan = UserManager(recorder)
+    expire = datetime.now() + timedelta(minutes=30)
+    userMan.find_user("schema-check")
+    userMan.find_user_by_email("schema-check@example.com")
+    userMan.user_exists("schema-check", "schema-check@example.com")
+    userMan.add_user("schema-check", "schema-check@example.com", "schema-check")
+    userMan.change_password("schema-check", "schema-check")
+    userMan.add_confirm("schema-check", "schema-check-token", expire)
+    userMan.add_reset("schema-check", "schema-check-token", expire)
+    userMan.add_session("schema-check", "schema-check-token", expire)
+    userMan.check_confirm_token("schema-check-token")
+    userMan.check_reset_token("schema-check-token")
+    userMan.check_session_token("schema-check-token")
+    userMan.update_confirm("schema-check", "schema-check-token")
+    userMan.update_reset("schema-check", "schema-check")
+    userMan.update_session("schema-check", expire)
+    userMan.add_revocation("schema-check", None, datetime.now(), expire)
+    userMan.load_revocations()
+    userMan.purge_expired()
+    return unique_queries(recorder.queries)
+
+# Collect every query UsageTracker issues
+def collect_usage_queries():
+    recorder = RecordingSqlClient()
+    usage = UsageTracker(recorder)
+    usage.record("schema-check", {"inputTokens": 1, "outputTokens": 1})
+    usage.flush()
+    usage.top_users(datetime.now().date())
+    return unique_queries(recorder.queries)
+
+# Manages versioned schema migrations for the genai database
+class SchemaManager:
+    def __init__(self, sqlClient):
+        # sqlClient for running DDL and EXPLAIN statements
+        self.sqlClient = sqlClient
+
+    # Get the set of migration versions already applied
+    def applied_versions(self):
+        self.sqlClient._execute(f"""CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+            version INT UNSIGNED NOT NULL,
+            description VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (version)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""")
+        rows = self.sqlClient.read_table(VERSION_TABLE)
+        return {row["version"] for row in rows}
+
+    # Apply every pending migration in order
+    def migrate(self):
+        applied = self.applied_versions()
+        pending = [m for m in MIGRATIONS if m[0] not in applied]
+        if not pending:
+            logger.info("Schema is up to date")
+            return []
+        for version, description, steps in pending:
+            logger.info("Applying migration %s: %s", version, description)
+            for step in steps:
+                if callable(step):
+                    step(self)
+                else:
+                    self.sqlClient._execute(step)
+            self.sqlClient.create_entry({"version": version, "description": description}, VERSION_TABLE)
+        return [m[0] for m in pending]
+
+    # Indexes of a table as name -> (unique, [columns in order])
+    def table_indexes(self, table):
+        rows = self.sqlClient._execute(
+            """SELECT INDEX_NAME AS index_name, NON_UNIQUE AS non_unique, COLUMN_NAME AS column_name
+            FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+            ORDER BY INDEX_NAME, SEQ_IN_INDEX""", (table,), fetch=True)
+        indexes = {}
+        for row in rows:
+            entry = indexes.setdefault(row["index_name"], (not row["non_unique"], []))
+            entry[1].append(row["column_name"])
+        return indexes
+
+    # Whether an existing index already serves a key
+    # A plain key is served by any index that starts with its columns, a unique key needs a
+    # unique index on exactly its columns, and there is only one primary key
+    def has_key(self, indexes, name, kind, columns):
+        if kind == "PRIMARY KEY":
+            primary = indexes.get("PRIMARY")
+            if primary and primary[1] != columns:
+                raise MigrationError(f"Primary key is on {primary[1]}, expected {columns}")
+            return primary is not None
+        if kind == "UNIQUE KEY":
+            return any(unique and indexColumns == columns for unique, indexColumns in indexes.values())
+        return any(indexColumns[:len(columns)] == columns for _, indexColumns in indexes.values())
+
+    # Fail if duplicate values would stop a unique key from being added
+    def check_duplicates(self, table, name, columns):
+        columnList = ", ".join(columns)
+        duplicates = self.sqlClient._execute(
+            f"SELECT {columnList}, COUNT(*) AS copies FROM {table} GROUP BY {columnList} HAVING COUNT(*) > 1 LIMIT 5",
+            fetch=True)
+        if duplicates:
+            examples = ", ".join(str([row[col] for col in columns]) for row in duplicates)
+            raise MigrationError(f"Cannot add {name} to {table}: duplicate {columnList} values (e.g. {examples}). "
+                                 f"Remove the duplicates and run migrate again")
+
+    # Add every key in tableKeys that an existing table does not have yet
+    def add_missing_keys(self, tableKeys):
+        for table, keys in tableKeys.items():
+            indexes = self.table_indexes(table)
+            for name, kind, columns in keys:
+                if self.has_key(indexes, name, kind, columns):
+                    continue
+                if kind != "KEY":
+                    self.check_duplicates(table, name, columns)
+                keyName = "" if kind == "PRIMARY KEY" else f" {name}"
+                logger.info("Adding %s%s to existing table %s", kind, keyName, table)
+                self.sqlClient._execute(f"ALTER TABLE {table} ADD {kind}{keyName} ({', '.join(columns)})")
+                indexes[name] = (kind != "KEY", columns)
+
+    # List (version, description, applied) for every known migration
+    def status(self):
+        applied = self.applied_versions()
+        return [(version, description, version in applied) for version, description, _ in MIGRATIONS]
+
+    # Run EXPLAIN on every UserManager and UsageTracker query and return the ones that scan a whole table
+    def check(self):
+        failures = []
+        with self.sqlClient.connection() as conn:
+            with conn.cursor() as cursor:
+                for sql, params in collect_user_queries() + collect_usage_queries():
+                    # Inserts never scan, so only look at reads, updates and deletes
+                    if sql.lstrip().upper().startswith("INSERT"):
+                        continue
+                    cursor.execute(f"EXPLAIN {sql}", params)
+                    for row in cursor.fetchall():
+                        if row.get("type") in FULL_SCAN_TYPES:
+                            failures.append((sql, row))
+                        logger.debug("EXPLAIN %s => type=%s key=%s", sql, row.get('type'), row.get('key'))
+        return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the genai database schema")
+    parser.add_argument("command", choices=["migrate", "status", "check", "sweep"],
+                        help="migrate: apply pending migrations, status: list migrations, "
+                             "check: EXPLAIN every UserManager and UsageTracker query and fail on full scans, "
+                             "sweep: delete expired tokens")
+    parser.add_argument("--verbose", action="store_true", help="Enable debug logging")
+    args = parser.parse_args()
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)-11s [%(levelname)s] %(message)s (%(name)s:%(lineno)d)"
+    )
+    # Reuse the webapp's configuration to find the database
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "aws")))
+    from aws_config import AWSConfig
+    userMan = AWSConfig().create()["userMan"]
+    schemaMan = SchemaManager(userMan.sqlClient)
+    if args.command == "migrate":
+        try:
+            applied = schemaMan.migrate()
+        except MigrationError as e:
+            logger.error("Migration failed: %s", e)
+            return 1
+        print(f"Applied migrations: {applied}" if applied else "Schema is up to date")
+    elif args.command == "status":
+        for version, description, applied in schemaMan.status():
+            print(f"{version:>4}  {'applied' if applied else 'pending':<8} {description}")
+    elif args.command == "check":
+        failures = schemaMan.check()
+        for sql, row in failures:
+            print(f"FULL SCAN ({row.get('type')}) on {row.get('table')}: {sql}")
+        if failures:
+            return 1
+        print("All UserManager and UsageTracker queries use an index")
+    elif args.command == "sweep":
+        userMan.purge_expired()
+        print("Expired tokens removed")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
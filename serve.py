@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+#
+# Production launcher: preloads the webapp once, then forks worker processes
+# that each run a waitress server on the same listening socket.
+#
+#   python serve.py --workers 4 --threads 8 --port 8080
+#
+# Signals to the master process:
+#   SIGHUP          re-exec the master so it loads new code and SSM configuration,
+#                   then replace workers one at a time without dropping the listener
+#   SIGTERM/SIGINT  drain in-flight requests in every worker and exit
+
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import _thread
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger("serve")
+
+# Worker: serve requests until SIGTERM, then stop accepting and drain
+def run_worker(webapp, sock, args, readyFd):
+    from waitress import create_server
+    # Drop the master's handler, restarts are driven by the master
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    # Fresh AWS session and clients for this process
+    webapp.aws_config.after_fork()
+    server = create_server(webapp.app, sockets=[sock], threads=args.threads)
+
+    # Stop accepting, close idle keep-alive connections, then interrupt the main loop
+    def drain():
+        server.accepting = False
+        deadline = time.monotonic() + args.graceful_timeout
+        while time.monotonic() < deadline:
+            channels = list(server.active_channels.values())
+            if not channels:
+                break
+            for channel in channels:
+                if not channel.requests:
+                    channel.will_close = True
+            time.sleep(0.1)
+        drained.set()
+        _thread.interrupt_main()
+
+    draining = threading.Event()
+    drained = threading.Event()
+    def handle_term(signum, frame):
+        if draining.is_set():
+            return
+        draining.set()
+        logger.info("Worker %s draining", os.getpid())
+        threading.Thread(target=drain, daemon=True).start()
+    # Ctrl-C reaches the whole process group, so workers only stop once drained
+    def handle_int(signum, frame):
+        if drained.is_set():
+            raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, handle_term)
+    signal.signal(signal.SIGINT, handle_int)
+    # Tell the master this worker is ready
+    os.write(readyFd, b"1")
+    os.close(readyFd)
+    logger.info("Worker %s serving with %s threads", os.getpid(), args.threads)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        server.task_dispatcher.shutdown()
+    # Write token usage counted since the last flush (workers skip atexit)
+    webapp.app.config["Config"]["usage"].flush()
+    logger.info("Worker %s exited", os.getpid())
+
+# Environment used to hand the listener and running workers to a re-exec'd master
+LISTEN_FD_ENV = "SERVE_LISTEN_FD"
+WORKERS_ENV = "SERVE_WORKERS"
+
+# Master: supervises the workers
+class Master:
+    def __init__(self, webapp, sock, args, inherited=None):
+        self.webapp = webapp
+        self.sock = sock
+        self.args = args
+        # pid -> worker number
+        self.workers = {}
+        # Workers started by the master image this one replaced, pid -> worker number
+        self.inherited = inherited or {}
+        # Workers being replaced or stopped, not to be respawned
+        self.retiring = set()
+        self.restartRequested = False
+        self.stopRequested = False
+
+    # Fork one worker and wait until it is ready to serve
+    def spawn(self, number):
+        readFd, writeFd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(readFd)
+            code = 0
+            try:
+                run_worker(self.webapp, self.sock, self.args, writeFd)
+            except Exception:
+                logger.error("Worker %s crashed", os.getpid(), exc_info=True)
+                code = 1
+            finally:
+                from log_config import stop_logging
+                stop_logging()
+                os._exit(code)
+        os.close(writeFd)
+        self.workers[pid] = number
+        # Wait for the ready byte (empty read means the worker died during startup)
+        ready = os.read(readFd, 1)
+        os.close(readFd)
+        if not ready:
+            logger.error("Worker %s failed to start", pid)
+        return pid
+
+    # Collect exited workers and respawn unexpected exits
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            number = self.workers.pop(pid, None)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            if number is not None and self.webapp is None:
+                logger.error("Worker %s exited (status %s), not respawned until the code loads", pid, status)
+                continue
+            if number is not None and not self.stopRequested:
+                logger.warning("Worker %s exited unexpectedly (status %s), respawning", pid, status)
+                time.sleep(1)
+                self.spawn(number)
+
+    # Replace this process with a fresh master running the current code
+    # The listener and the running workers (still our children, the pid does not change) carry over
+    def reexec(self):
+        logger.info("Re-executing master to reload code and configuration")
+        os.environ[LISTEN_FD_ENV] = str(self.sock.fileno())
+        os.environ[WORKERS_ENV] = ",".join(f"{pid}:{number}" for pid, number in self.workers.items())
+        # Handlers reset to default on exec, ignore HUP until the new master installs its own
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        from log_config import stop_logging
+        stop_logging()
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    # Start the workers, replacing inherited ones one at a time so there is always spare capacity
+    def start_workers(self):
+        self.workers.update(self.inherited)
+        if self.inherited:
+            logger.info("Rolling restart of %s workers", len(self.inherited))
+        for number in range(self.args.workers):
+            self.spawn(number)
+            for pid in [pid for pid, old in self.inherited.items() if old == number]:
+                self.stop_worker(pid)
+        # Inherited workers beyond the current worker count
+        for pid in list(self.inherited):
+            if pid in self.workers:
+                self.stop_worker(pid)
+        self.inherited = {}
+
+    # Ask one worker to drain and wait for it to exit
+    def stop_worker(self, pid):
+        self.retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while pid in self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        if pid in self.workers:
+            logger.warning("Worker %s did not exit in time, killing", pid)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.workers.pop(pid, None)
+            self.retiring.discard(pid)
+
+    # webapp is None when a re-exec'd master could not load the new code,
+    # it then only supervises the inherited workers until the next HUP or TERM
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, "restartRequested", True))
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, "stopRequested", True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, "stopRequested", True))
+        if self.webapp is None:
+            self.workers.update(self.inherited)
+            self.inherited = {}
+            logger.error("Keeping %s workers of the previous code, fix the deploy and send HUP again", len(self.workers))
+        else:
+            self.start_workers()
+        logger.info("Master %s running %s workers on %s:%s", os.getpid(), len(self.workers), self.args.host, self.args.port)
+        while not self.stopRequested:
+            if self.restartRequested:
+                self.reexec()
+            self.reap()
+            time.sleep(0.5)
+        logger.info("Stopping %s workers", len(self.workers))
+        for pid in list(self.workers):
+            self.retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.workers):
+            self.stop_worker(pid)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the webapp with preloaded, forked waitress workers")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"), help="Address to bind")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8080)), help="Port to bind")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", os.cpu_count() or 1)),
+                        help="Number of worker processes")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("THREADS", 8)),
+                        help="Waitress threads per worker")
+    parser.add_argument("--graceful-timeout", type=float, default=30,
+                        help="Seconds a worker may spend finishing requests on shutdown")
+    args = parser.parse_args()
+    # Bind before loading the app so every worker inherits the same socket,
+    # or take over the socket and workers of the master image that re-exec'd into this one
+    inherited = {}
+    if LISTEN_FD_ENV in os.environ:
+        sock = socket.socket(fileno=int(os.environ.pop(LISTEN_FD_ENV)))
+        for item in filter(None, os.environ.pop(WORKERS_ENV, "").split(",")):
+            pid, number = item.split(":")
+            inherited[int(pid)] = int(number)
+    else:
+        sock = socket.create_server((args.host, args.port), backlog=1024)
+    sock.set_inheritable(True)
+    # AWS connection pools are sized from THREADS
+    os.environ["THREADS"] = str(args.threads)
+    # Preload the app: SSM config, templates and settings are shared copy-on-write
+    try:
+        import genai_webapp
+        for template in genai_webapp.app.jinja_env.list_templates():
+            genai_webapp.app.jinja_env.get_template(template)
+    except (Exception, SystemExit):
+        # On a fresh start there is nothing to keep serving
+        if not inherited:
+            raise
+        # After HUP the old workers still hold the listener, so stay up to supervise them
+        logger.critical("Failed to load the webapp after HUP, keeping the running workers", exc_info=True)
+        Master(None, sock, args, inherited).run()
+        return 1
+    # Keep preloaded objects out of the collector so it does not touch (and copy) their pages
+    gc.freeze()
+    Master(genai_webapp, sock, args, inherited).run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Prefix for the current signed token format
+TOKEN_VERSION = "v1"
+
+# Helpers for unpadded URL-safe base64
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+# Class for issuing and validating HMAC-signed session cookies
+class SignedSessionManager:
+    def __init__(self, secret, userMan, lifetime=timedelta(minutes=30), refreshInterval=30):
+        # Key for signing session claims
+        self.key = secret.encode() if isinstance(secret, str) else secret
+        # userMan for storing and loading revocations
+        self.userMan = userMan
+        # How long a session stays valid without activity
+        self.lifetime = lifetime
+        # Seconds between reloads of the revocation list
+        self.refreshInterval = refreshInterval
+        # Revoked session ids and per-user "not before" times (ms since epoch)
+        self.revokedSessions = set()
+        self.userNotBefore = {}
+        self.lastRefresh = 0.0
+        self.refreshLock = threading.Lock()
+        logger.info("SignedSessionManager initialized")
+
+    # Sign a payload
+    def _sign(self, payload):
+        return _b64encode(hmac.new(self.key, f"{TOKEN_VERSION}.{payload}".encode(), hashlib.sha256).digest())
+
+    # Create a signed token for username
+    # When refreshing, sessionId and authTime (ms of the original login) carry over,
+    # so revocations by login time still apply to refreshed tokens
+    def issue(self, username, sessionId=None, authTime=None):
+        now = time.time()
+        claims = {
+            "sub": username,
+            "iat": int(now * 1000),
+            "auth": authTime or int(now * 1000),
+            "exp": int(now + self.lifetime.total_seconds()),
+            "sid": sessionId or secrets.token_hex(16)
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        return f"{TOKEN_VERSION}.{payload}.{self._sign(payload)}"
+
+    # Return the claims of a correctly signed, unexpired token, otherwise None
+    def verify(self, token):
+        try:
+            version, payload, signature = token.split(".")
+        except (AttributeError, ValueError):
+            return None
+        if version != TOKEN_VERSION or not hmac.compare_digest(signature, self._sign(payload)):
+            logger.warning("Session token signature invalid")
+            return None
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            return None
+        # Revocation is decided by the auth claim, so a token without it is not valid
+        if not isinstance(claims, dict) or not all(k in claims for k in ("sub", "iat", "auth", "exp", "sid")):
+            logger.warning("Session token is missing claims")
+            return None
+        if time.time() > claims["exp"]:
+            logger.debug("Session token expired for user '%s'", claims['sub'])
+            return None
+        return claims
+
+    # Check whether the claims have been revoked
+    def is_revoked(self, claims):
+        self._maybe_refresh()
+        if claims["sid"] in self.revokedSessions:
+            return True
+        return claims["auth"] < self.userNotBefore.get(claims["sub"], -1)
+
+    # Return the username for a valid, unrevoked token, otherwise None
+    def check(self, token):
+        claims = self.verify(token)
+        if not claims or self.is_revoked(claims):
+            return None
+        return claims["sub"]
+
+    # Return a re-signed token once the current one is past half its lifetime, otherwise None
+    def refresh(self, token):
+        claims = self.verify(token)
+        if not claims or self.is_revoked(claims):
+            return None
+        if claims["exp"] - time.time() > self.lifetime.total_seconds() / 2:
+            return None
+        return self.issue(claims["sub"], claims["sid"], claims["auth"])
+
+    # How long a revocation must be kept: any token it covers may still be refreshed
+    # by a process that has not reloaded the list yet, so allow for one reload interval
+    def _revocation_expiry(self, now):
+        return now + self.lifetime + timedelta(seconds=self.refreshInterval)
+
+    # Revoke a single session (e.g. logout)
+    def revoke(self, token):
+        claims = self.verify(token)
+        if not claims:
+            return
+        now = datetime.now()
+        self.userMan.add_revocation(claims["sub"], claims["sid"], now, self._revocation_expiry(now))
+        # Apply locally right away, other processes pick it up on their next refresh
+        self.revokedSessions.add(claims["sid"])
+
+    # Revoke every session issued to username so far (e.g. password change)
+    def revoke_user(self, username):
+        now = datetime.now()
+        self.userMan.add_revocation(username, None, now, self._revocation_expiry(now))
+        self.userNotBefore[username] = int(now.timestamp() * 1000)
+
+    # Reload the revocation list if it is older than refreshInterval
+    def _maybe_refresh(self):
+        if time.time() - self.lastRefresh < self.refreshInterval:
+            return
+        # Only one thread reloads, the others keep using the current list
+        if not self.refreshLock.acquire(blocking=False):
+            return
+        try:
+            self.refresh_revocations()
+        except Exception as e:
+            # Keep serving with the old list rather than failing requests
+            logger.error("Failed to refresh session revocations: %s", e, exc_info=True)
+        finally:
+            self.lastRefresh = time.time()
+            self.refreshLock.release()
+
+    # Load the revocation list from the database
+    def refresh_revocations(self):
+        revokedSessions = set()
+        userNotBefore = {}
+        for row in self.userMan.load_revocations():
+            if row["session_id"]:
+                revokedSessions.add(row["session_id"])
+            else:
+                revokedAt = int(row["revoked_at"].timestamp() * 1000)
+                userNotBefore[row["username"]] = max(revokedAt, userNotBefore.get(row["username"], -1))
+        self.revokedSessions = revokedSessions
+        self.userNotBefore = userNotBefore
+        logger.debug("Loaded %s revoked sessions and %s revoked users", len(revokedSessions), len(userNotBefore))
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage signed sessions")
+    parser.add_argument("command", choices=["revoke"], help="revoke: end every session for a user")
+    parser.add_argument("username", help="User whose sessions are revoked")
+    args = parser.parse_args()
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="%(asctime)-11s [%(levelname)s] %(message)s (%(name)s:%(lineno)d)"
+    )
+    # Reuse the webapp's configuration to find the database and signing key
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "aws")))
+    from aws_config import AWSConfig
+    configStore = AWSConfig().create()
+    sessionMan = configStore.get("sessionMan")
+    if sessionMan:
+        sessionMan.revoke_user(args.username)
+    else:
+        # Table-backed sessions are revoked by removing the row
+        userMan = configStore["userMan"]
+        userMan.delete_token(args.username, userMan.sessionTable)
+    print(f"Revoked sessions for {args.username}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import time
+import logging
+import threading
+from resilience import DeadlineExceeded, remaining
+
+logger = logging.getLogger(__name__)
+
+# One call being made (or recently made) on behalf of a user
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finishedAt = None
+
+# Serializes work per user and collapses duplicate submissions of the same request
+# Calls with the same (username, requestId) share one execution and its result,
+# calls with different ids from the same user run one at a time
+class SingleFlight:
+    def __init__(self, resultTtl=120, waitTimeout=180):
+        # Seconds a finished result is replayed to late duplicates
+        self.resultTtl = resultTtl
+        # Most seconds a call waits for the original call or the user's lock,
+        # shortened to what is left of the request deadline
+        self.waitTimeout = waitTimeout
+        self.lock = threading.Lock()
+        # (username, requestId) -> Call
+        self.calls = {}
+        # username -> [lock, number of callers holding or waiting for it]
+        self.userLocks = {}
+        logger.debug("SingleFlight initialized")
+
+    # Drop finished calls older than the result TTL (caller holds self.lock)
+    def _expire(self):
+        cutoff = time.monotonic() - self.resultTtl
+        for callKey in [k for k, call in self.calls.items() if call.finishedAt and call.finishedAt < cutoff]:
+            del self.calls[callKey]
+
+    # Seconds a call may wait right now
+    def _wait_time(self):
+        left = remaining()
+        return self.waitTimeout if left is None else max(0.0, min(self.waitTimeout, left))
+
+    # Take the user's lock, creating it on first use, and return False if it was not free in time
+    def _acquire_user(self, username):
+        with self.lock:
+            entry = self.userLocks.setdefault(username, [threading.Lock(), 0])
+            entry[1] += 1
+        if entry[0].acquire(timeout=self._wait_time()):
+            return True
+        with self.lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.userLocks[username]
+        return False
+
+    # Release the user's lock, removing it once nobody holds or waits for it
+    def _release_user(self, username):
+        with self.lock:
+            entry = self.userLocks[username]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.userLocks[username]
+
+    # Run fn for the user, or return the result of an identical call already made
+    # requestId may be None, in which case the call is only serialized
+    def do(self, username, requestId, fn):
+        callKey = (username, requestId)
+        with self.lock:
+            self._expire()
+            call = self.calls.get(callKey) if requestId else None
+            owner = call is None
+            if owner:
+                call = Call()
+                if requestId:
+                    self.calls[callKey] = call
+        if not owner:
+            logger.info("Joining in-flight request %s for '%s'", requestId, username)
+            if not call.done.wait(self._wait_time()):
+                raise DeadlineExceeded(f"Timed out waiting for request {requestId}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+        if not self._acquire_user(username):
+            # Another request from the user is still running, fail this one and its duplicates
+            call.error = DeadlineExceeded(f"Timed out waiting for an earlier request from '{username}'")
+            with self.lock:
+                self.calls.pop(callKey, None)
+            call.finishedAt = time.monotonic()
+            call.done.set()
+            raise call.error
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            # Let a retry with the same id run again instead of replaying the failure
+            with self.lock:
+                self.calls.pop(callKey, None)
+            raise
+        finally:
+            self._release_user(username)
+            call.finishedAt = time.monotonic()
+            call.done.set()
@@ -1,6 +1,8 @@
 import logging
 from contextlib import contextmanager
 import pymysql
+from request_stats import track
+from resilience import DeadlineExceeded, call_timeout, remaining
 
 logger = logging.getLogger(__name__)
 
@@ -12,45 +14,59 @@ class SqlClient:
         self.db=name
         self.user=user
         self.password=password 
-        logger.debug(f"MySQLClient initialized for DB: {name} on host: {host}")
+        logger.debug("MySQLClient initialized for DB: %s on host: %s", name, host)
     
     # Context manager for establishing and closing a MySQL connection
     @contextmanager
     def connection(self):
         logger.debug("Establishing MySQL database connection")
+        conn = None
         try:
-            # Try to connect to the database
+            # Try to connect to the database, within what is left of the request deadline
+            connectTimeout = call_timeout("mysql", 10)
+            queryTimeout = remaining()
             conn = pymysql.connect(
                 host=self.host,
                 user=self.user,
                 password=self.password,
                 db=self.db,
-                cursorclass=pymysql.cursors.DictCursor
+                cursorclass=pymysql.cursors.DictCursor,
+                connect_timeout=connectTimeout,
+                read_timeout=queryTimeout,
+                write_timeout=queryTimeout
             )
             logger.debug("MySQL connection established successfully")
             yield conn
+        except DeadlineExceeded:
+            # Out of time before connecting, callers turn this into a 503
+            raise
         except Exception as e:
             # Log and raise connection error
-            logger.error(f"Failed to connect to MySQL database: {e}", exc_info=True)
+            logger.error("Failed to connect to MySQL database: %s", e, exc_info=True)
             raise
         finally:
-            logger.debug("Closing MySQL database connection")
-            try:
-                # Try to disconnect from the database
-                conn.close()
-                logger.debug("MySQL connection closed")
-            except Exception as e:
-                # Log disconnect error
-                logger.error(f"Error closing MySQL connection: {e}", exc_info=True)
+            if conn is not None:
+                logger.debug("Closing MySQL database connection")
+                try:
+                    # Try to disconnect from the database
+                    conn.close()
+                    logger.debug("MySQL connection closed")
+                except Exception as e:
+                    # Log disconnect error
+                    logger.error("Error closing MySQL connection: %s", e, exc_info=True)
     
     # Helper function to execute SQL queries
-    def _execute(self, sql, params=(), fetch=False):
+    # many runs the query once per tuple in params, batched into one statement for inserts
+    def _execute(self, sql, params=(), fetch=False, many=False):
         # Connect to database
-        with self.connection() as conn:
+        with track("sql"), self.connection() as conn:
             try:
                 with conn.cursor() as cursor:
                     # Execute SQL query
-                    cursor.execute(sql, params)
+                    if many:
+                        cursor.executemany(sql, params)
+                    else:
+                        cursor.execute(sql, params)
                     if fetch:
                         # Return all results for read
                         return cursor.fetchall()
@@ -58,12 +74,16 @@ class SqlClient:
                 conn.commit()
             except Exception as e:
                 # Log and raise SQL query error
-                logger.error(f"MySQL query failed: {e}", exc_info=True)
+                logger.error("MySQL query failed: %s", e, exc_info=True)
                 raise
     
+    # Check that the database answers a trivial query
+    def ping(self):
+        self._execute("SELECT 1", fetch=True)
+
     # Create a new entry to a table
     def create_entry(self, entry, table):
-        logger.debug(f"Adding entry into table: {table}")
+        logger.debug("Adding entry into table: %s", table)
         # Set up SQL query
         columns = ', '.join(entry.keys())
         placeholders = ', '.join(['%s']*len(entry))
@@ -74,20 +94,62 @@ class SqlClient:
         self._execute(sql, params)
         logger.debug("Entry added successfully.")
 
+    # Insert rows, or add their counter columns to the rows with the same key
+    def upsert_counters(self, rows, keyColumns, table):
+        logger.debug("Upserting %s rows into table: %s", len(rows), table)
+        # Set up SQL query
+        columns = list(rows[0].keys())
+        placeholders = ', '.join(['%s']*len(columns))
+        increments = ", ".join(f"{col} = {col} + VALUES({col})" for col in columns if col not in keyColumns)
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) ON DUPLICATE KEY UPDATE {increments}"
+        # Set up parameters, one tuple per row
+        params = [tuple(row[col] for col in columns) for row in rows]
+        # Execute query as a single multi-row insert
+        self._execute(sql, params, many=True)
+        logger.debug("Rows upserted successfully.")
+
     # Read all rows from a table
     def read_table(self, table):
-        logger.debug(f"Reading all entries from table: {table}")
+        logger.debug("Reading all entries from table: %s", table)
         # Set up SQL query
         sql = f"SELECT * FROM {table}"
         # Execute query
         results = self._execute(sql, fetch=True)
-        logger.debug(f"Successfully read {len(results)} entries from table: {table}")
+        logger.debug("Successfully read %s entries from table: %s", len(results), table)
+        # Return results
+        return results or []
+
+    # Read rows from a table that match filters
+    def read_entry(self, filters, table, anyMatch=False):
+        logger.debug("Reading matching entries from table: %s", table)
+        # Set up SQL query
+        joiner = " OR " if anyMatch else " AND "
+        filterColumns = joiner.join(f"{col} = %s" for col in filters.keys())
+        sql = f"SELECT * FROM {table} WHERE {filterColumns}"
+        # Set up parameters
+        params = tuple(filters.values())
+        # Execute query
+        results = self._execute(sql, params, fetch=True)
+        logger.debug("Successfully read %s matching entries from table: %s", len(results), table)
+        # Return results
+        return results or []
+
+    # Read rows from a table whose column is at or after the cutoff
+    def read_active(self, column, cutoff, table):
+        logger.debug("Reading active entries from table: %s", table)
+        # Set up SQL query
+        sql = f"SELECT * FROM {table} WHERE {column} >= %s"
+        # Set up parameters
+        params = (cutoff,)
+        # Execute query
+        results = self._execute(sql, params, fetch=True)
+        logger.debug("Successfully read %s active entries from table: %s", len(results), table)
         # Return results
         return results or []
 
     # Update rows in a table that match filters
     def update_entry(self, updateValues, filters, table):
-        logger.debug(f"Updating entry in table: {table}")
+        logger.debug("Updating entry in table: %s", table)
         # Set up SQL query
         setColumns = ", ".join(f"{col} = %s" for col in updateValues.keys())
         filterColumns = " AND ".join(f"{col} = %s" for col in filters.keys())
@@ -96,11 +158,11 @@ class SqlClient:
         params = tuple(updateValues.values()) + tuple(filters.values())
         # Execute query
         self._execute(sql, params)
-        logger.debug(f"Entry updated successfully.")
+        logger.debug("Entry updated successfully.")
     
     # Delete rows from a table that match filters
     def delete_entry(self, filters, table):
-        logger.debug(f"Removing entry in table: {table}")
+        logger.debug("Removing entry in table: %s", table)
         # Set up SQL query
         filterColumns = " AND ".join(f"{col} = %s" for col in filters.keys())
         sql = f"DELETE FROM {table} WHERE {filterColumns}"
@@ -108,4 +170,15 @@ class SqlClient:
         params = tuple(filters.values())
         # Execute query
         self._execute(sql, params)
-        logger.debug(f"Entry removed successfully.")
\ No newline at end of file
+        logger.debug("Entry removed successfully.")
+
+    # Delete rows from a table whose column is older than the cutoff
+    def delete_expired(self, column, cutoff, table):
+        logger.debug("Removing expired entries in table: %s", table)
+        # Set up SQL query
+        sql = f"DELETE FROM {table} WHERE {column} < %s"
+        # Set up parameters
+        params = (cutoff,)
+        # Execute query
+        self._execute(sql, params)
+        logger.debug("Expired entries removed successfully.")
\ No newline at end of file
@@ -31,6 +31,6 @@ export AWSREGION=us-east-1
 # Run the webapp
 echo "Running app"
 cd $APP_HOME
-# Run using Waitress on port 8080
-python -m waitress --host=0.0.0.0 --port=8080 genai_webapp:app
+# Run preloaded Waitress workers on port 8080
+python serve.py --host=0.0.0.0 --port=8080
 deactivate
\ No newline at end of file
@@ -0,0 +1,329 @@
+#
+# Drive every route through the Flask test client and check its dependency calls
+# against ROUTE_BUDGETS in request_stats.py.
+#
+#   python -m pytest tests
+#
+# AWSConfig.create() runs unchanged on top of fake boto3 clients and a SQLite-backed
+# SqlClient, so the calls are counted by the real wrappers (SqlClient._execute,
+# S3Client._s3_call, SesClient.send_email, BedrockClient.generate).
+
+import io
+import os
+import re
+import sys
+import hashlib
+import sqlite3
+import threading
+from datetime import date, datetime
+from types import SimpleNamespace
+import pytest
+from botocore.exceptions import ClientError
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "aws")]
+
+# Settings read when the webapp is imported
+os.environ.update({
+    "AWSREGION": "us-east-1",
+    "HISTORYSTORE": "s3",
+    "SESSIONMODE": "table",
+    "PROFILING": "1",
+    "ADMINUSERS": "alice",
+    "LOGLEVEL": "WARNING",
+})
+
+import aws_config
+from sql_client import SqlClient
+from request_stats import assert_max_calls, track
+from chat_search import PREVIEW_CHUNK
+
+# Values the webapp reads from Parameter Store
+PARAMETERS = {
+    "/genai/sender": "noreply@example.com",
+    "/genai/dbHost": "localhost",
+    "/genai/dbUsername": "genai",
+    "/genai/dbPassword": "genai",
+    "/genai/bucket": "genai-test",
+}
+
+# Tables of schema.py, in SQLite syntax
+SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT NOT NULL UNIQUE, password TEXT NOT NULL,
+                    email TEXT NOT NULL UNIQUE, confirmed BOOLEAN NOT NULL DEFAULT 0);
+CREATE TABLE confirmation (token TEXT PRIMARY KEY, username TEXT NOT NULL UNIQUE, expiration DATETIME NOT NULL);
+CREATE TABLE password_reset (token TEXT PRIMARY KEY, username TEXT NOT NULL UNIQUE, expiration DATETIME NOT NULL);
+CREATE TABLE sessions (token TEXT PRIMARY KEY, username TEXT NOT NULL UNIQUE, expiration DATETIME NOT NULL);
+CREATE TABLE session_revocation (id INTEGER PRIMARY KEY, username TEXT NOT NULL, session_id TEXT,
+                                 revoked_at DATETIME NOT NULL, expiration DATETIME NOT NULL);
+CREATE TABLE token_usage (username TEXT NOT NULL, day DATE NOT NULL, input_tokens INTEGER NOT NULL DEFAULT 0,
+                          output_tokens INTEGER NOT NULL DEFAULT 0, requests INTEGER NOT NULL DEFAULT 0,
+                          PRIMARY KEY (username, day));
+"""
+
+# Store values the way MySQL's VARCHAR and DATETIME columns hand them back (bcrypt hashes are bytes)
+sqlite3.register_adapter(bytes, lambda value: value.decode())
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter("DATETIME", lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+
+# SqlClient that runs its queries on an in-memory SQLite database
+# Only _execute is replaced, so every query is still counted once
+class SqliteSqlClient(SqlClient):
+    def __init__(self, host, name, user, password):
+        super().__init__(host, name, user, password)
+        self.conn = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        self.conn.row_factory = lambda cursor, row: {col[0]: value for col, value in zip(cursor.description, row)}
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def _execute(self, sql, params=(), fetch=False, many=False):
+        with track("sql"), self.lock:
+            sql = sql.replace("%s", "?")
+            cursor = self.conn.executemany(sql, params) if many else self.conn.execute(sql, params)
+            results = cursor.fetchall() if fetch else None
+            self.conn.commit()
+            return results
+
+    # SQLite spells MySQL's ON DUPLICATE KEY UPDATE as ON CONFLICT DO UPDATE
+    def upsert_counters(self, rows, keyColumns, table):
+        columns = list(rows[0].keys())
+        placeholders = ", ".join(["%s"] * len(columns))
+        increments = ", ".join(f"{col} = {col} + excluded.{col}" for col in columns if col not in keyColumns)
+        sql = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) "
+               f"ON CONFLICT ({', '.join(keyColumns)}) DO UPDATE SET {increments}")
+        self._execute(sql, [tuple(row[col] for col in columns) for row in rows], many=True)
+
+# Build the ClientError botocore raises for a failed call
+def client_error(code, status, operation):
+    return ClientError({"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, operation)
+
+# Parts of a boto3 client the wrappers and ClientFactory use besides the operations
+class FakeClient:
+    def __init__(self):
+        self.meta = SimpleNamespace(events=SimpleNamespace(register=lambda *args, **kwargs: None))
+        self.exceptions = SimpleNamespace(ClientError=ClientError)
+
+# S3 bucket kept in a dict, with ETags and conditional writes
+class FakeS3(FakeClient):
+    def __init__(self):
+        super().__init__()
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def get_object(self, Bucket, Key):
+        with self.lock:
+            if Key not in self.objects:
+                raise client_error("NoSuchKey", 404, "GetObject")
+            body, etag = self.objects[Key]
+        return {"Body": io.BytesIO(body), "ETag": etag}
+
+    def head_object(self, Bucket, Key):
+        with self.lock:
+            if Key not in self.objects:
+                raise client_error("404", 404, "HeadObject")
+            return {"ETag": self.objects[Key][1]}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, Metadata=None, IfMatch=None, IfNoneMatch=None):
+        with self.lock:
+            current = self.objects.get(Key)
+            if (IfNoneMatch and current) or (IfMatch and (not current or current[1] != IfMatch)):
+                raise client_error("PreconditionFailed", 412, "PutObject")
+            etag = f'"{hashlib.md5(Body).hexdigest()}"'
+            self.objects[Key] = (Body, etag)
+        return {"ETag": etag}
+
+    def delete_object(self, Bucket, Key):
+        with self.lock:
+            self.objects.pop(Key, None)
+        return {}
+
+    def head_bucket(self, Bucket):
+        return {}
+
+# SES that keeps the emails it was asked to send
+class FakeSes(FakeClient):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def send_email(self, **payload):
+        self.sent.append(payload)
+        return {"MessageId": f"message-{len(self.sent)}"}
+
+    # Body of the last email sent
+    def last_body(self):
+        return self.sent[-1]["Message"]["Body"]["Text"]["Data"]
+
+# Parameter Store with fixed values
+class FakeSsm(FakeClient):
+    def __init__(self):
+        super().__init__()
+        self.exceptions.ParameterNotFound = type("ParameterNotFound", (Exception,), {})
+
+    def get_parameter(self, Name, WithDecryption=False):
+        if Name not in PARAMETERS:
+            raise self.exceptions.ParameterNotFound(Name)
+        return {"Parameter": {"Value": PARAMETERS[Name]}}
+
+# Bedrock runtime that answers with a numbered reply
+class FakeBedrockRuntime(FakeClient):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def converse(self, modelId, messages, system, inferenceConfig):
+        # The real API rejects any key other than role and content
+        assert all(set(message) == {"role", "content"} for message in messages)
+        self.calls += 1
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": f"Answer {self.calls}"}]}},
+            "usage": {"inputTokens": 10, "outputTokens": 5, "totalTokens": 15},
+        }
+
+# boto3 session that hands out one shared fake per service, whatever the client config
+class FakeSession:
+    def __init__(self):
+        self.clients = {"s3": FakeS3(), "ses": FakeSes(), "ssm": FakeSsm(), "bedrock-runtime": FakeBedrockRuntime()}
+
+    def client(self, service, config=None):
+        return self.clients[service]
+
+SESSION = FakeSession()
+aws_config.AWSCredHelper.get_session = lambda self, awsProfile=None, awsRegion=None: SESSION
+aws_config.SqlClient = SqliteSqlClient
+
+import genai_webapp
+
+@pytest.fixture(scope="module")
+def app():
+    config = genai_webapp.app.config["Config"]
+    userMan = config["userMan"]
+    userMan.add_user("alice", "alice@example.com", "alice-password")
+    userMan.sqlClient.update_entry({"confirmed": True}, {"username": "alice"}, userMan.userTable)
+    return genai_webapp.app
+
+# A test client logged in as alice
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    response = client.post("/login", data={"username": "alice", "password": "alice-password"})
+    assert response.status_code == 302
+    return client
+
+# Token from the link in the last email sent
+def emailed_token():
+    return re.search(r"token=([\w-]+)", SESSION.clients["ses"].last_body()).group(1)
+
+def test_public_pages_stay_within_budget(app):
+    client = app.test_client()
+    with assert_max_calls() as seen:
+        for path in ("/", "/home", "/login", "/signup", "/forgot_password", "/ping", "/ready", "/metrics"):
+            assert client.get(path).status_code in (200, 302, 503)
+    assert len(seen) == 8
+
+def test_signup_and_confirm_email(app):
+    client = app.test_client()
+    with assert_max_calls("signup"):
+        response = client.post("/signup", data={"username": "bob", "password": "bob-password",
+                                                "email": "bob@example.com", "confirmEmail": "bob@example.com"})
+    assert response.status_code == 200
+    with assert_max_calls("confirm_email"):
+        response = client.get(f"/confirm_email?token={emailed_token()}")
+    assert response.status_code == 200
+    assert app.config["Config"]["userMan"].find_user("bob")["confirmed"]
+
+def test_login_and_logout(app):
+    client = app.test_client()
+    with assert_max_calls("login"):
+        response = client.post("/login", data={"username": "alice", "password": "alice-password"})
+    assert response.status_code == 302
+    with assert_max_calls("logout"):
+        client.get("/logout")
+    assert client.get("/chat").status_code == 302
+
+def test_password_reset(app):
+    client = app.test_client()
+    with assert_max_calls("forgot_password"):
+        assert client.post("/forgot_password", data={"email": "alice@example.com"}).status_code == 200
+    token = emailed_token()
+    with assert_max_calls("reset_password"):
+        assert client.get(f"/reset_password?token={token}").status_code == 200
+        response = client.post(f"/reset_password?token={token}",
+                               data={"password": "alice-password", "confirmPassword": "alice-password"})
+    assert response.status_code == 200
+
+def test_change_password(client):
+    with assert_max_calls("change_password"):
+        assert client.get("/change_password").status_code == 200
+        response = client.post("/change_password", data={"oldPassword": "alice-password", "newPassword": "alice-password",
+                                                          "confirmPassword": "alice-password"})
+    assert response.status_code == 302
+
+def test_send_history_and_search(app, client):
+    with assert_max_calls("chat"):
+        assert client.get("/chat").status_code == 200
+    with assert_max_calls("send_message"):
+        for number in range(3):
+            response = client.post("/send", json={"message": f"sourdough question {number}", "requestId": f"send-{number}"})
+            assert response.get_json()["response"].startswith("Answer")
+    with assert_max_calls("history") as seen:
+        response = client.get("/history?limit=2")
+        assert [m["offset"] for m in response.get_json()["messages"]] == [5, 4]
+        # Unchanged history: one HEAD and no body
+        assert client.get("/history?limit=2", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    assert seen[-1].calls["s3"] == 1
+    with assert_max_calls("search") as seen:
+        results = client.get("/search?q=sourdough").get_json()["results"]
+    assert [r["offset"] for r in results] == [4, 2, 0]
+    # The index saved by /send is still cached, so only its version is checked
+    assert seen[-1].calls["s3"] == 1
+
+def test_duplicate_send_is_answered_once(app, client):
+    bedrock = SESSION.clients["bedrock-runtime"]
+    with assert_max_calls("send_message"):
+        first = client.post("/send", json={"message": "hello twice", "requestId": "dup-1"}).get_json()
+        before = bedrock.calls
+        second = client.post("/send", json={"message": "hello twice", "requestId": "dup-1"}).get_json()
+    assert first == second
+    assert bedrock.calls == before
+
+def test_token_usage_is_flushed_and_added_up(app, client):
+    usage = app.config["Config"]["usage"]
+    client.post("/send", json={"message": "count my tokens"})
+    usage.flush()
+    row = usage.sqlClient.read_entry({"username": "alice"}, usage.usageTable)[0]
+    client.post("/send", json={"message": "count these too"})
+    usage.flush()
+    # The second flush adds to the stored row
+    after = usage.sqlClient.read_entry({"username": "alice"}, usage.usageTable)[0]
+    assert after["requests"] == row["requests"] + 1
+    assert after["input_tokens"] + after["output_tokens"] == row["input_tokens"] + row["output_tokens"] + 15
+    assert usage.used_today("alice") == after["input_tokens"] + after["output_tokens"]
+
+def test_search_reads_preview_chunks_of_old_turns(app, client):
+    with assert_max_calls("send_message"):
+        for number in range(PREVIEW_CHUNK // 2 + 1):
+            client.post("/send", json={"message": f"chunked topic{number}"})
+    # A process that has not seen the index yet downloads it and the chunk holding the match, with no HEAD
+    app.config["Config"]["chatSearch"].cache.clear()
+    app.config["Config"]["chatSearch"].chunks.clear()
+    with assert_max_calls("search") as seen:
+        results = client.get("/search?q=topic0").get_json()["results"]
+    assert results and results[0]["snippet"] == "chunked topic0"
+    assert seen[-1].calls["s3"] == 2
+
+def test_admin_profiles(app, client):
+    assert client.get("/chat", headers={"X-Profile": "1"}).status_code == 200
+    with assert_max_calls("admin_profiles"):
+        profiles = client.get("/admin/profiles").get_json()["profiles"]
+    assert profiles
+    with assert_max_calls("admin_profile"):
+        response = client.get(f"/admin/profiles/{profiles[0]['id']}")
+    assert response.status_code == 200
+
+def test_budget_overrun_is_reported(client):
+    with pytest.raises(AssertionError, match="chat made 2 sql calls"):
+        with assert_max_calls(sql=1):
+            client.get("/chat")
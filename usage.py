@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import atexit
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# Raised instead of calling the model when a user has used up today's tokens
+class QuotaExceeded(Exception):
+    def __init__(self, username, used, quota):
+        super().__init__(f"Daily token quota reached ({used}/{quota})")
+        self.username = username
+        self.used = used
+        self.quota = quota
+        # Quotas reset at midnight UTC
+        now = datetime.now(timezone.utc)
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), timezone.utc)
+        self.retryAfter = (midnight - now).total_seconds()
+
+# Parse "alice=500000,bob=0" into a dict of per-user quotas
+def parse_quotas(spec):
+    quotas = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        username, _, quota = item.partition("=")
+        quotas[username.strip()] = int(quota)
+    return quotas
+
+# Today's date in UTC, the day usage is counted against
+def today():
+    return datetime.now(timezone.utc).date()
+
+# Per-user Bedrock token accounting with daily quotas
+# Usage is counted in memory and flushed to MySQL in batches by a background thread,
+# which also reloads today's totals so quotas include usage from other processes
+class UsageTracker:
+    def __init__(self, sqlClient, dailyQuota=0, quotas=None, flushInterval=10):
+        # sqlClient for the usage table
+        self.sqlClient = sqlClient
+        # Table of token counts per user per day
+        self.usageTable = "token_usage"
+        # Daily token quota for every user (0 means unlimited) and per-user overrides
+        self.dailyQuota = dailyQuota
+        self.quotas = quotas or {}
+        # Seconds between flushes
+        self.flushInterval = flushInterval
+        # (username, day) -> [input tokens, output tokens, requests] not yet flushed
+        self.pending = {}
+        # Counts being written by the current flush
+        self.inflight = {}
+        # (username, day) -> total tokens stored in MySQL at the last flush
+        self.stored = {}
+        self.lock = threading.Lock()
+        self.flushLock = threading.Lock()
+        # Process that owns the flush thread (threads do not survive fork)
+        self.pid = None
+        logger.info("UsageTracker initialized")
+
+    # Build a tracker from TOKENQUOTA, TOKENQUOTAS and USAGEFLUSH environment settings
+    @classmethod
+    def from_env(cls, sqlClient):
+        return cls(
+            sqlClient,
+            int(os.environ.get("TOKENQUOTA", 0)),
+            parse_quotas(os.environ.get("TOKENQUOTAS", "")),
+            float(os.environ.get("USAGEFLUSH", 10)),
+        )
+
+    # Start the flush thread for this process if it is not running
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # Counts copied from the parent process belong to the parent
+            self.pid = os.getpid()
+            self.pending = {}
+            self.inflight = {}
+            threading.Thread(target=self._loop, name="usage-flush", daemon=True).start()
+            atexit.register(self.flush)
+
+    # Flush forever
+    def _loop(self):
+        while True:
+            time.sleep(self.flushInterval)
+            self.flush()
+
+    # Daily quota for a user, 0 means unlimited
+    def quota_for(self, username):
+        return self.quotas.get(username, self.dailyQuota)
+
+    # Tokens a user has used today, as far as this process knows
+    def used_today(self, username):
+        key = (username, today())
+        with self.lock:
+            total = self.stored.get(key, 0)
+            for counts in (self.inflight.get(key), self.pending.get(key)):
+                if counts:
+                    total += counts[0] + counts[1]
+        return total
+
+    # Raise QuotaExceeded if the user has no tokens left today (no database access)
+    # Called before every model call, so it also starts the flush thread
+    def check(self, username):
+        self.start()
+        quota = self.quota_for(username)
+        if quota <= 0:
+            return
+        used = self.used_today(username)
+        if used >= quota:
+            logger.warning("User '%s' reached the daily token quota (%s/%s)", username, used, quota)
+            raise QuotaExceeded(username, used, quota)
+
+    # Count the tokens of one model response
+    def record(self, username, usage):
+        key = (username, today())
+        with self.lock:
+            counts = self.pending.setdefault(key, [0, 0, 0])
+            counts[0] += usage.get("inputTokens", 0)
+            counts[1] += usage.get("outputTokens", 0)
+            counts[2] += 1
+
+    # Write pending counts in one batched upsert, then reload today's totals
+    def flush(self):
+        with self.flushLock:
+            with self.lock:
+                self.inflight, self.pending = self.pending, {}
+                batch = self.inflight
+            if batch:
+                rows = [
+                    {"username": username, "day": day, "input_tokens": counts[0],
+                     "output_tokens": counts[1], "requests": counts[2]}
+                    for (username, day), counts in batch.items()
+                ]
+                try:
+                    self.sqlClient.upsert_counters(rows, ["username", "day"], self.usageTable)
+                except Exception as e:
+                    # Keep the counts for the next flush
+                    logger.error("Failed to flush token usage: %s", e, exc_info=True)
+                    with self.lock:
+                        for key, counts in self.inflight.items():
+                            merged = self.pending.setdefault(key, [0, 0, 0])
+                            for i in range(3):
+                                merged[i] += counts[i]
+                        self.inflight = {}
+                    return
+                logger.debug("Flushed token usage for %s users", len(rows))
+            try:
+                day = today()
+                stored = {
+                    (row["username"], day): row["input_tokens"] + row["output_tokens"]
+                    for row in self.sqlClient.read_entry({"day": day}, self.usageTable)
+                }
+            except Exception as e:
+                # The counts are stored, only the totals are stale until the next flush
+                logger.error("Failed to reload token usage: %s", e, exc_info=True)
+                with self.lock:
+                    # Fold the written counts into the old totals so quotas still see them
+                    for key, counts in self.inflight.items():
+                        self.stored[key] = self.stored.get(key, 0) + counts[0] + counts[1]
+                    self.inflight = {}
+                return
+            with self.lock:
+                self.stored = stored
+                self.inflight = {}
+
+    # Users with the most tokens since the given day, as dicts sorted by total
+    def top_users(self, since, limit=20):
+        totals = {}
+        for row in self.sqlClient.read_active("day", since, self.usageTable):
+            entry = totals.setdefault(row["username"], {"username": row["username"], "requests": 0,
+                                                        "input_tokens": 0, "output_tokens": 0})
+            for column in ("requests", "input_tokens", "output_tokens"):
+                entry[column] += row[column]
+        for entry in totals.values():
+            entry["total_tokens"] = entry["input_tokens"] + entry["output_tokens"]
+        return sorted(totals.values(), key=lambda entry: entry["total_tokens"], reverse=True)[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description="Report Bedrock token usage")
+    parser.add_argument("command", choices=["report"], help="report: list the top token consumers")
+    parser.add_argument("--days", type=int, default=1, help="Number of days to include, counting today")
+    parser.add_argument("--top", type=int, default=20, help="Number of users to list")
+    args = parser.parse_args()
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format="%(asctime)-11s [%(levelname)s] %(message)s (%(name)s:%(lineno)d)"
+    )
+    # Reuse the webapp's configuration to find the database
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "aws")))
+    from aws_config import AWSConfig
+    usage = AWSConfig().create()["usage"]
+    since = today() - timedelta(days=args.days - 1)
+    print(f"Token usage since {since} (UTC)")
+    print(f"{'user':<24} {'requests':>9} {'input':>12} {'output':>12} {'total':>12} {'quota':>10}")
+    for entry in usage.top_users(since, args.top):
+        quota = usage.quota_for(entry["username"]) or "-"
+        print(f"{entry['username']:<24} {entry['requests']:>9} {entry['input_tokens']:>12} "
+              f"{entry['output_tokens']:>12} {entry['total_tokens']:>12} {quota:>10}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,49 +17,49 @@ class UserManager:
         self.resetTable = "password_reset"
         # Table for user sessions
         self.sessionTable = "sessions"
+        # Table for revoked signed sessions
+        self.revokeTable = "session_revocation"
         logger.info("UserManager initialized")
 
-    # Helper function to load sql table
-    def _load_table(self, table):
-        logger.debug(f"Loading table '{table}'")
-        return self.sqlClient.read_table(table)
+    # Helper function to load matching rows from sql table
+    def _load_rows(self, filters, table, anyMatch=False):
+        logger.debug("Loading rows from table '%s'", table)
+        return self.sqlClient.read_entry(filters, table, anyMatch)
 
     # Find a user based on their username
     def find_user(self, username):
-        # Load users
-        users = self._load_table(self.userTable)
-        # Check if there is a user that matches the username
-        user = next((u for u in users if u["username"]==username), None)
+        # Look up the user by username
+        users = self._load_rows({"username": username}, self.userTable)
+        user = next(iter(users), None)
         if user:
-            logger.debug(f"Found user '{username}'")
+            logger.debug("Found user '%s'", username)
         else:
-            logger.debug(f"User '{username}' not found")
+            logger.debug("User '%s' not found", username)
         return user
 
     # Find a user based on their email
     def find_user_by_email(self, email):
-        # Load users
-        users = self._load_table(self.userTable)
-        # Check if there is a user that matches the email
-        user = next((u for u in users if u["email"]==email), None)
+        # Look up the user by email
+        users = self._load_rows({"email": email}, self.userTable)
+        user = next(iter(users), None)
         if user:
-            logger.debug(f"Found user with email '{email}'")
+            logger.debug("Found user with email '%s'", email)
         else:
-            logger.debug(f"No user found with email '{email}'")
+            logger.debug("No user found with email '%s'", email)
         return user
     
     # Check that the password is correct
     def check_password(self, user, password):
         # Check whether or not the entered password matches the database password
         result = user and bcrypt.checkpw(password.encode(), user["password"].encode())
-        logger.debug(f"Password check for user '{user['username'] if user else 'None'}': {result}")
+        logger.debug("Password check for user '%s': %s", user['username'] if user else 'None', result)
         return result
     
     # Check that the user is confirmed
     def check_confirm(self, user):
         # Check user confirmation status
         status = user["confirmed"]
-        logger.debug(f"Confirmation status for user '{user['username']}': {status}")
+        logger.debug("Confirmation status for user '%s': %s", user['username'], status)
         return status
 
     # Change password for user
@@ -71,16 +71,16 @@ class UserManager:
         userUpdateValue  = {"password": hashedPassword}
         userUpdateFilter = {"username": username}
         self.sqlClient.update_entry(userUpdateValue, userUpdateFilter, self.userTable)
-        logger.info(f"Password changed for user '{username}'")
+        logger.info("Password changed for user '%s'", username)
 
     # Check if the username or email is already in use
     def user_exists(self, username, email):
-        # Load users
-        users = self._load_table(self.userTable)
+        # Load users that match either the username or the email
+        users = self._load_rows({"username": username, "email": email}, self.userTable, anyMatch=True)
         # Check if username or email match any existing users
         usernameMatch = any(username==user["username"] for user in users)
         emailMatch = any(email==user["email"] for user in users)
-        logger.debug(f"user_exists('{username}', '{email}') => (username: {usernameMatch}, email: {emailMatch})")
+        logger.debug("user_exists('%s', '%s') => (username: %s, email: %s)", username, email, usernameMatch, emailMatch)
         # Return results
         return (usernameMatch, emailMatch)
     
@@ -92,7 +92,7 @@ class UserManager:
         # Add new user info to user table
         userEntry = {"username": username, "password": hashedPassword, "email": email, "confirmed": False}
         self.sqlClient.create_entry(userEntry, self.userTable)
-        logger.info(f"Added new user '{username}' with email '{email}'")
+        logger.info("Added new user '%s' with email '%s'", username, email)
     
     # Add token to table
     def add_token(self, username, token, expire, table):
@@ -101,7 +101,7 @@ class UserManager:
         # Add new token to table
         entry = {"username": username, "token": token, "expiration": sqlExpire}
         self.sqlClient.create_entry(entry, table)
-        logger.info(f"Added token for user '{username}' in table '{table}' (expires {sqlExpire})")
+        logger.info("Added token for user '%s' in table '%s' (expires %s)", username, table, sqlExpire)
     
     def delete_token(self, username, table):
         # Delete old token if it exists
@@ -129,17 +129,16 @@ class UserManager:
         if not token:
             # Return nothing if there is no token
             return None
-        # Load users that need token
-        tokens = self._load_table(table)
-        # Find entry if there is one that matches the token 
-        tokenEntry = next((row for row in tokens if row["token"]==token), None)
+        # Find entry if there is one that matches the token
+        tokens = self._load_rows({"token": token}, table)
+        tokenEntry = next(iter(tokens), None)
         # Check that the token hasn't expired
         if tokenEntry and datetime.now() <= tokenEntry["expiration"]:
             # Return confirmed username if token is valid
-            logger.debug(f"Valid token for user '{tokenEntry['username']}' in table '{table}'")
+            logger.debug("Valid token for user '%s' in table '%s'", tokenEntry['username'], table)
             return tokenEntry["username"]
         # Return nothing if it has expired
-        logger.warning(f"Token invalid or expired in table '{table}'")
+        logger.warning("Token invalid or expired in table '%s'", table)
         return None
 
     # Check that confirmation has not expired
@@ -163,7 +162,7 @@ class UserManager:
         # Delete the user's entry in the confirmation table
         confirmDeleteFilter = {"token": token}
         self.sqlClient.delete_entry(confirmDeleteFilter, self.confirmTable)
-        logger.info(f"User '{username}' confirmed and token '{token}' deleted")
+        logger.info("User '%s' confirmed and token '%s' deleted", username, token)
 
     # Update password for user
     def update_reset(self, username, password):
@@ -172,7 +171,7 @@ class UserManager:
         # Delete the user's entry in the reset table
         resetDeleteFilter = {"username": username}
         self.sqlClient.delete_entry(resetDeleteFilter, self.resetTable)
-        logger.info(f"Password reset for user '{username}' and reset token cleared")
+        logger.info("Password reset for user '%s' and reset token cleared", username)
 
     # Update session for user
     def update_session(self, username, expire):
@@ -180,4 +179,27 @@ class UserManager:
         # Update confirmation status for user
         sessionUpdateValue = {"expiration": sqlExpire}
         sessionUpdateFilter = {"username": username}
-        self.sqlClient.update_entry(sessionUpdateValue, sessionUpdateFilter, self.sessionTable)
\ No newline at end of file
+        self.sqlClient.update_entry(sessionUpdateValue, sessionUpdateFilter, self.sessionTable)
+
+    # Revoke one signed session, or every session issued before revokedAt if sessionId is None
+    def add_revocation(self, username, sessionId, revokedAt, expire):
+        entry = {
+            "username": username,
+            "session_id": sessionId,
+            "revoked_at": revokedAt.strftime('%Y-%m-%d %H:%M:%S.%f'),
+            "expiration": expire.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        self.sqlClient.create_entry(entry, self.revokeTable)
+        logger.info("Revoked %s for user '%s'", 'session ' + sessionId if sessionId else 'all sessions', username)
+
+    # Load revocations that still cover unexpired sessions
+    def load_revocations(self):
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return self.sqlClient.read_active("expiration", now, self.revokeTable)
+
+    # Remove expired tokens from confirmation, reset and session tables
+    def purge_expired(self):
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for table in (self.confirmTable, self.resetTable, self.sessionTable, self.revokeTable):
+            self.sqlClient.delete_expired("expiration", now, table)
+        logger.info("Expired tokens purged")
\ No newline at end of file